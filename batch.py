@@ -0,0 +1,255 @@
+import argparse
+import csv
+import hashlib
+import importlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from combo_scheduler import coverage_scheduler
+from dedup import headline_index
+from taxonomy import Sampler, is_random
+from tenants import tenant_registry
+
+logger = logging.getLogger(__name__)
+
+# Folder where every batch keeps the ids of the jobs already written
+CHECKPOINT_DIR = os.getenv('BATCH_CHECKPOINT_DIR', 'batches')
+
+# Number of topics generated at the same time, and number of rows collected before each write
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '4'))
+BATCH_FLUSH_ROWS = int(os.getenv('BATCH_FLUSH_ROWS', '60'))
+
+# Batches started from the web app, by batch id
+batch_runs = {}
+batch_runs_lock = threading.Lock()
+
+
+def read_jobs(content, filename, default_user='january', seed=None):
+    # Accept either a CSV file with a header row or a JSONL file with one object per line
+    text = content.decode('utf-8-sig') if isinstance(content, bytes) else content
+    if filename.lower().endswith(('.jsonl', '.json')):
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+
+    # With a seed, draw the combinations for every 'Random' choice in one go so the same seed gives the same
+    # picks; without one, 'Random' is left for the coverage scheduler to fill with combinations not used yet
+    combinations = Sampler(seed).sample(len(records)) if seed is not None else [('Random',) * 3] * len(records)
+
+    jobs = []
+    for number, (record, combination) in enumerate(zip(records, combinations), start=1):
+        topic = (record.get('topic') or '').strip()
+        if not topic:
+            logger.warning("Skipping line %s of %s: no topic", number, filename)
+            continue
+
+        jobs.append({
+            'id': str(number),
+            'topic': topic,
+            'engagement_format': combination[0] if is_random(record.get('engagement_format')) else record['engagement_format'],
+            'emotional_trigger': combination[1] if is_random(record.get('emotional_trigger')) else record['emotional_trigger'],
+            'tone': combination[2] if is_random(record.get('tone')) else record['tone'],
+            'user': record.get('user') or default_user,
+        })
+    return jobs
+
+
+class BatchRun:
+    def __init__(self, batch_id, jobs, create_rows, get_user_store, workers=BATCH_WORKERS,
+                 flush_rows=BATCH_FLUSH_ROWS, max_retries=5, backoff=2.0, checkpoint_dir=CHECKPOINT_DIR):
+        self.batch_id = batch_id
+        self.jobs = jobs
+        self.create_rows = create_rows
+        self.get_user_store = get_user_store
+        self.workers = workers
+        self.flush_rows = flush_rows
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        # Jobs listed in the checkpoint file were written before a restart and are skipped
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.checkpoint_path = os.path.join(checkpoint_dir, f"{batch_id}.done")
+        self.done = set()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                self.done = {line.strip() for line in checkpoint if line.strip()}
+
+        self.failed = []
+        self.running = False
+        self.pending = []  # (job, store, rows) waiting for the next write
+        self.pause_until = 0.0  # set when OpenAI reports a rate limit so every worker backs off
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+
+    def status(self):
+        with self.lock:
+            return {
+                'batch_id': self.batch_id,
+                'total': len(self.jobs),
+                'done': len(self.done),
+                'failed': list(self.failed),
+                'running': self.running,
+            }
+
+    def run(self):
+        self.running = True
+        try:
+            todo = [job for job in self.jobs if job['id'] not in self.done]
+            logger.info("Batch %s: %s of %s jobs left", self.batch_id, len(todo), len(self.jobs))
+
+            # A fixed number of workers keeps the load on OpenAI bounded
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='batch') as pool:
+                list(pool.map(self.run_job, todo))
+
+            self.flush(final=True)
+        finally:
+            self.running = False
+        return self.status()
+
+    def run_job(self, job):
+        # Whatever goes wrong with one job is reported with it, so the other jobs carry on
+        try:
+            self.generate(job)
+        except Exception as error:
+            logger.exception("Batch %s: job %s failed", self.batch_id, job['id'])
+            self.fail(job, str(error))
+
+    def generate(self, job):
+        store = self.get_user_store(job['user'])
+        if store is None:
+            self.fail(job, "Invalid sheet name.")
+            return
+
+        try:
+            conditions = coverage_scheduler.next_conditions(
+                store, job['topic'], job['engagement_format'], job['emotional_trigger'], job['tone'])
+        except ValueError as error:
+            self.fail(job, str(error))
+            return
+
+        for attempt in range(self.max_retries + 1):
+            # Wait out any rate limit pause another worker has hit
+            delay = self.pause_until - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            try:
+                rows = self.create_rows(job['topic'], *conditions)
+                break
+            except openai.error.RateLimitError:
+                if attempt == self.max_retries:
+                    self.fail(job, "Rate limited")
+                    return
+                with self.lock:
+                    self.pause_until = max(self.pause_until, time.monotonic() + self.backoff * 2 ** attempt)
+            except Exception as error:
+                logger.exception("Batch %s: job %s failed", self.batch_id, job['id'])
+                self.fail(job, str(error))
+                return
+
+        # Near-duplicates of earlier headlines for the topic are dropped rather than paid for again
+        rows = headline_index.unique_rows(store, rows)
+
+        with self.lock:
+            self.pending.append((job, store, rows))
+            ready = sum(len(rows) for _, _, rows in self.pending) >= self.flush_rows
+
+        if ready:
+            self.flush()
+
+    def fail(self, job, reason):
+        with self.lock:
+            self.failed.append({'id': job['id'], 'topic': job['topic'], 'error': reason})
+
+    def flush(self, final=False):
+        # Write the collected rows one store at a time and record that store's jobs as soon as its rows are in,
+        # so a resume never writes them again. Rows a store didn't take are kept for the next flush; after the
+        # last one their jobs are reported as failed, and left for a resume to generate again
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+
+            # Group the rows by store so each one gets a single batch write
+            batches = {}
+            for entry in pending:
+                batches.setdefault(id(entry[1]), []).append(entry)
+            for entries in batches.values():
+                store = entries[0][1]
+                rows = [row for _, _, job_rows in entries for row in job_rows]
+                try:
+                    if rows:
+                        store.write_rows(rows)
+                except Exception as error:
+                    logger.exception("Batch %s: could not write %s rows", self.batch_id, len(rows))
+                    if final:
+                        for job, _, _ in entries:
+                            self.fail(job, f"Could not write the rows: {error}")
+                    else:
+                        with self.lock:
+                            self.pending[:0] = entries
+                    continue
+                self.checkpoint([job['id'] for job, _, _ in entries])
+
+    def checkpoint(self, job_ids):
+        # Only record the jobs once their rows are written, so a crash never loses or repeats rows
+        with open(self.checkpoint_path, 'a') as checkpoint:
+            checkpoint.write(''.join(f"{job_id}\n" for job_id in job_ids))
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        with self.lock:
+            self.done.update(job_ids)
+
+
+def batch_id_for(content, app_name=''):
+    # The same file for the same app always gets the same id, so uploading it again resumes it
+    digest = hashlib.sha1(app_name.encode('utf-8'))
+    digest.update(content if isinstance(content, bytes) else content.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def start_batch(content, filename, create_rows, get_user_store, default_user='january', seed=None, app_name=''):
+    # Run a batch in the background for the web app; a batch that is still running is returned as is
+    batch_id = batch_id_for(content, app_name)
+    with batch_runs_lock:
+        run = batch_runs.get(batch_id)
+        if run is not None and run.running:
+            return run
+
+        run = BatchRun(batch_id, read_jobs(content, filename, default_user, seed), create_rows, get_user_store)
+        run.running = True
+        batch_runs[batch_id] = run
+
+    threading.Thread(target=run.run, name=f"batch-{batch_id}", daemon=True).start()
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate headlines for every topic in a CSV or JSONL file.")
+    parser.add_argument('file', help="CSV with a header row, or JSONL (topic, engagement_format, emotional_trigger, tone, user)")
+    parser.add_argument('--app', choices=['main', 'gdn'], default='main', help="which app's prompts and spreadsheet to use")
+    parser.add_argument('--user', help="user for lines that do not name one (default: the first tenant)")
+    parser.add_argument('--seed', help="draw the 'Random' choices from this seed instead of the coverage scheduler")
+    parser.add_argument('--workers', type=int, default=BATCH_WORKERS, help="topics generated at the same time")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pipeline = importlib.import_module(args.app).pipeline
+
+    with open(args.file, 'rb') as jobs_file:
+        content = jobs_file.read()
+
+    batch_id = batch_id_for(content, pipeline.name)
+    run = BatchRun(batch_id, read_jobs(content, args.file, args.user or tenant_registry.default_user(), args.seed),
+                   pipeline.create_rows, pipeline.get_user_store, workers=args.workers)
+    print(json.dumps(run.run(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
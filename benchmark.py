@@ -0,0 +1,380 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from gspread.exceptions import APIError
+
+# Words the mock OpenAI server builds its replies from, so headlines differ enough to pass the duplicate check
+WORDS = ('fresh', 'smart', 'bold', 'quiet', 'bright', 'simple', 'rapid', 'golden', 'hidden', 'daily', 'modern',
+         'secret', 'honest', 'lucky', 'local', 'better', 'winning', 'clever', 'proven', 'easy')
+
+TOPICS = ('solar panels', 'dental implants', 'home insurance', 'electric cars', 'senior living', 'credit cards')
+
+
+class Faults:
+    def __init__(self, latency=0.0, error_rate=0.0, quota=0):
+        # Every mocked call waits `latency` seconds, fails with a server error at `error_rate`,
+        # and is refused as over quota once more than `quota` calls were made in the last minute (0 = unlimited)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota = quota
+        self.calls = Counter()
+        self.recent = []
+        self.lock = threading.Lock()
+
+    def check(self, kind):
+        # Count the call and return the status it fails with, or None when it succeeds
+        with self.lock:
+            self.calls[kind] += 1
+            now = time.monotonic()
+            self.recent = [at for at in self.recent if now - at < 60]
+            self.recent.append(now)
+            over_quota = self.quota and len(self.recent) > self.quota
+        time.sleep(self.latency)
+        if over_quota:
+            return 429
+        if random.random() < self.error_rate:
+            return 500
+        return None
+
+    def total(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    # Keep connections open between requests like the real API does
+    protocol_version = 'HTTP/1.1'
+    faults = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        chat = self.path.endswith('/chat/completions')
+        status = self.faults.check('chat' if chat else 'completion')
+        if status is not None:
+            kind = 'rate_limit_exceeded' if status == 429 else 'server_error'
+            return self.reply(status, {'error': {'message': f"Mock {kind}", 'type': kind, 'code': None}})
+
+        prompt = body['messages'][-1]['content'] if chat else body['prompt']
+        if 'JSON only' in prompt:
+            # A headline set: as many headlines as the prompt asks for and one description
+            count = int(prompt.split('Create ', 1)[1].split()[0])
+            text = json.dumps({'headlines': [self.sentence() for _ in range(count)], 'description': self.sentence()})
+        else:
+            text = self.sentence()
+
+        choice = {'index': 0, 'finish_reason': 'stop'}
+        if chat:
+            choice['message'] = {'role': 'assistant', 'content': text}
+        else:
+            choice['text'] = text
+        usage = {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(text) // 4}
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        self.reply(200, {'object': 'chat.completion' if chat else 'text_completion', 'choices': [choice], 'usage': usage})
+
+    @staticmethod
+    def sentence():
+        return ' '.join(random.sample(WORDS, 6)).capitalize()
+
+    def reply(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_openai(faults):
+    # Serve the OpenAI completion endpoints on a free local port
+    handler = type('Handler', (MockOpenAIHandler,), {'faults': faults})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-openai', daemon=True).start()
+    return server
+
+
+class MockWorksheet:
+    def __init__(self, spreadsheet_id, index, faults):
+        # Just the worksheet calls the apps make, kept in memory
+        self.spreadsheet_id = spreadsheet_id
+        self.id = index
+        self.faults = faults
+        self.rows = [["Topic", "Engagement Format", "Emotional Trigger", "Tone", "Headline", "Description"]]
+        self.lock = threading.Lock()
+
+    @property
+    def row_count(self):
+        return 1000
+
+    def call(self, kind):
+        status = self.faults.check(kind)
+        if status is not None:
+            response = requests.Response()
+            response.status_code = status
+            response._content = json.dumps({'error': {'code': status, 'message': 'Mock error', 'status': 'MOCK'}}).encode()
+            raise APIError(response)
+
+    def append_row(self, row, **kwargs):
+        self.append_rows([row])
+
+    def append_rows(self, rows, **kwargs):
+        self.call('append_rows')
+        with self.lock:
+            first = len(self.rows) + 1
+            self.rows.extend(list(row) for row in rows)
+        # Where the rows went, like the Sheets API answers
+        return {'updates': {'updatedRange': f"Sheet{self.id + 1}!A{first}:F{first + len(rows) - 1}"}}
+
+    def get(self, cell_range, **kwargs):
+        self.call('get')
+        return self.read(cell_range)
+
+    def read(self, cell_range):
+        # 'A5:F20', or 'A5:F' for everything from row 5 on
+        first, last = (cell.lstrip('ABCDEF') for cell in cell_range.split(':'))
+        with self.lock:
+            return [list(row) for row in self.rows[int(first) - 1:int(last) if last else None]]
+
+    def col_values(self, column):
+        self.call('col_values')
+        with self.lock:
+            return [row[column - 1] for row in self.rows]
+
+    def get_all_values(self):
+        self.call('get_all_values')
+        with self.lock:
+            return [list(row) for row in self.rows]
+
+
+class MockSpreadsheet:
+    def __init__(self, key, faults):
+        self.key = key
+        self.worksheets = [MockWorksheet(key, index, faults) for index in range(2)]
+
+    def get_worksheet(self, index):
+        return self.worksheets[index]
+
+
+class MockSheetsClient:
+    def __init__(self, faults):
+        self.faults = faults
+        self.spreadsheets = {}
+
+    def open_by_key(self, key):
+        self.faults.check('open_by_key')
+        return self.spreadsheets.setdefault(key, MockSpreadsheet(key, self.faults))
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of a sorted list
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'requests_per_second': round((len(latencies) + errors) / elapsed, 2) if elapsed else None,
+    }
+
+
+def drive(count, concurrency, request):
+    # Run `request` `count` times from `concurrency` threads; it returns the latency, or raises when it fails
+    latencies = []
+    errors = Counter()
+    lock = threading.Lock()
+
+    def run(number):
+        try:
+            latency = request(number)
+        except Exception as error:
+            with lock:
+                errors[str(error)[:80]] += 1
+            return
+        with lock:
+            latencies.append(latency)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, range(count)))
+    result = summarize(latencies, sum(errors.values()), time.perf_counter() - started)
+    result['error_messages'] = dict(errors)
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    openai_faults = Faults(args.openai_latency, args.openai_error_rate, args.openai_quota)
+    sheets_faults = Faults(args.sheets_latency, args.sheets_error_rate, args.sheets_quota)
+
+    # Keep the benchmark's rate limits, caches and stores apart from the real ones
+    workdir = tempfile.mkdtemp(prefix='headlines-benchmark-')
+    os.environ['OPENAI_LIMITS_DB'] = os.path.join(workdir, 'openai_limits.db')
+    os.environ['HEADLINE_DB'] = os.path.join(workdir, 'headlines.db')
+    os.environ['SEARCH_DB'] = os.path.join(workdir, 'search.db')
+    os.environ['IDEMPOTENCY_DB'] = os.path.join(workdir, 'idempotency.db')
+    os.environ['BATCH_CHECKPOINT_DIR'] = os.path.join(workdir, 'batches')
+    os.environ['COMPLETION_CACHE'] = 'memory'
+    os.environ.setdefault('HEADLINE_STORE', 'sheets')
+    os.environ.setdefault('JOB_QUEUE_DEPTH', str(max(args.requests, 20)))
+
+    server = start_mock_openai(openai_faults)
+
+    import openai
+    import main
+    import gdn
+    from clients import sheets_clients
+    from http_pool import session_pools
+    from tenants import tenant_registry
+    from jobs import job_queue
+    from sheet_writer import write_buffer
+
+    openai.api_key = 'mock'
+    openai.api_base = f"http://127.0.0.1:{server.server_port}/v1"
+    sheets_clients.client = MockSheetsClient(sheets_faults)
+
+    app = main.app
+    pipeline = gdn.pipeline if args.prefix == '/gdn' else main.pipeline
+    results = {}
+
+    def counted(name, count, request):
+        # Drive one scenario and add the external calls it made per request
+        openai_before, sheets_before = openai_faults.total(), Counter(sheets_faults.calls)
+        result = drive(count, args.concurrency, request)
+        write_buffer.flush()
+        result['openai_calls_per_request'] = round((openai_faults.total() - openai_before) / count, 2)
+        result['sheets_calls_per_request'] = {
+            kind: round((calls - sheets_before[kind]) / count, 2)
+            for kind, calls in sheets_faults.calls.items() if calls > sheets_before[kind]
+        }
+        results[name] = result
+
+    def submit(number):
+        # POST the form and wait for its job, so the latency covers the whole generation
+        started = time.perf_counter()
+        response = app.test_client().post(args.prefix + '/', data={
+            'user': random.choice(tenant_registry.users())[0],
+            'topic': TOPICS[number % len(TOPICS)],
+            'engagement_format': 'Random',
+            'emotional_trigger': 'Random',
+            'tone': 'Random',
+        })
+        if response.status_code != 302:
+            raise RuntimeError(f"submit returned {response.status_code}")
+        job_id = response.location.split('job=')[1]
+        while True:
+            job = job_queue.get(job_id)
+            if job['status'] == 'done':
+                return time.perf_counter() - started
+            if job['status'] == 'failed':
+                raise RuntimeError(job['error'])
+            time.sleep(0.005)
+
+    def latest_topics(number):
+        started = time.perf_counter()
+        response = app.test_client().get(args.prefix + '/latest_topics?n=25')
+        if response.status_code != 200:
+            raise RuntimeError(f"latest_topics returned {response.status_code}")
+        return time.perf_counter() - started
+
+    def search(number):
+        # A keyword from one of the topics and a different page each time, so most requests miss the page cache
+        keyword = TOPICS[number % len(TOPICS)].split()[0]
+        started = time.perf_counter()
+        response = app.test_client().get(args.prefix + f'/search?q={keyword}&page={number % 5 + 1}')
+        if response.status_code != 200:
+            raise RuntimeError(f"search returned {response.status_code}")
+        return time.perf_counter() - started
+
+    def generate(number):
+        store = pipeline.get_user_store(tenant_registry.default_user())
+        started = time.perf_counter()
+        pipeline.generate_headlines(store, TOPICS[number % len(TOPICS)], 'Random', 'Random', 'Random')
+        return time.perf_counter() - started
+
+    scenarios = {'submit': submit, 'latest_topics': latest_topics, 'search': search,
+                 'generate_headlines': generate}
+    try:
+        for name in args.scenario or list(scenarios):
+            counted(name, args.requests, scenarios[name])
+    finally:
+        server.shutdown()
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+        'http_pools': session_pools.snapshot(),
+    }
+
+
+def compare(report, baseline):
+    # Print how every latency and throughput figure moved against an earlier report
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'requests_per_second', 'openai_calls_per_request'):
+            if result.get(metric) is None or not before.get(metric):
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            print(f"{name:20} {metric:26} {before[metric]:>10} -> {result[metric]:>10} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the headline routes against local mock OpenAI and Sheets APIs.")
+    parser.add_argument('--scenario', action='append',
+                        choices=['submit', 'latest_topics', 'search', 'generate_headlines'],
+                        help="scenario to run, may be repeated (default: all)")
+    parser.add_argument('--prefix', default='', choices=['', '/gdn'], help="'' for the search pages, '/gdn' for GDN")
+    parser.add_argument('--requests', type=int, default=50, help="requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests in flight at the same time")
+    parser.add_argument('--openai-latency', type=float, default=0.3, help="seconds every mock OpenAI call takes")
+    parser.add_argument('--openai-error-rate', type=float, default=0.0, help="share of OpenAI calls that fail with 500")
+    parser.add_argument('--openai-quota', type=int, default=0, help="OpenAI calls per minute before 429s (0 = unlimited)")
+    parser.add_argument('--sheets-latency', type=float, default=0.1, help="seconds every mock Sheets call takes")
+    parser.add_argument('--sheets-error-rate', type=float, default=0.0, help="share of Sheets calls that fail with 500")
+    parser.add_argument('--sheets-quota', type=int, default=0, help="Sheets calls per minute before 429s (0 = unlimited)")
+    parser.add_argument('--output', default='benchmark.json', help="where to save the JSON report")
+    parser.add_argument('--compare', help="earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(json.dumps(report['results'], indent=2))
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(report, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
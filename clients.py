@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+import time
+
+import gspread
+from google.auth.transport.requests import AuthorizedSession, Request
+from gspread.utils import convert_credentials
+from oauth2client.service_account import ServiceAccountCredentials
+
+from http_pool import session_pools
+
+logger = logging.getLogger(__name__)
+
+# Use the service account credentials and gspread to access the Google Spreadsheets
+SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+
+
+class SheetsUnavailable(Exception):
+    pass
+
+
+class SheetsClientProvider:
+    def __init__(self, credentials_file='credentials.json', refresh_interval=30 * 60, retry_after=10,
+                 worksheet_ttl=60 * 60, health_ttl=30):
+        # Nothing is read or opened here; the first caller connects and everyone after reuses it
+        self.credentials_file = credentials_file
+        self.refresh_interval = refresh_interval
+        self.retry_after = retry_after
+        self.worksheet_ttl = worksheet_ttl
+        self.health_ttl = health_ttl
+        self.client = None
+        self.spreadsheets = {}  # spreadsheet key -> opened spreadsheet
+        self.worksheets = {}  # (spreadsheet key, index or title) -> (worksheet, time it was looked up)
+        self.last_error = None
+        self.failed_at = 0.0
+        self.refreshed_at = None
+        self.refresher = None
+        self.probe = None  # (time of the last health probe, error or None)
+        self.probe_lock = threading.Lock()
+        self.lock = threading.RLock()
+
+    def get_client(self):
+        if self.client is not None:
+            return self.client
+
+        with self.lock:
+            if self.client is not None:
+                return self.client
+
+            # Don't hammer Google while it is down; fail fast until the retry delay has passed
+            if self.last_error is not None and time.monotonic() - self.failed_at < self.retry_after:
+                raise SheetsUnavailable(self.last_error)
+
+            try:
+                creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_file, SCOPE)
+                # Sheets calls share one pool of kept-alive connections
+                session = session_pools.session('sheets', AuthorizedSession(convert_credentials(creds)))
+                self.client = gspread.authorize(None, session=session)
+            except Exception as error:
+                self.last_error = f"{type(error).__name__}: {error}"
+                self.failed_at = time.monotonic()
+                logger.exception("Could not connect to Google Sheets")
+                raise SheetsUnavailable(self.last_error) from error
+
+            self.last_error = None
+            self.start_refresher()
+            return self.client
+
+    def open_by_key(self, key):
+        spreadsheet = self.spreadsheets.get(key)
+        if spreadsheet is not None:
+            return spreadsheet
+
+        with self.lock:
+            if key not in self.spreadsheets:
+                try:
+                    self.spreadsheets[key] = self.get_client().open_by_key(key)
+                except SheetsUnavailable:
+                    raise
+                except Exception as error:
+                    raise SheetsUnavailable(f"{type(error).__name__}: {error}") from error
+            return self.spreadsheets[key]
+
+    def worksheet(self, key, index=0):
+        # Worksheet handles, by position or title, are kept so looking one up doesn't cost a metadata request
+        # every time; after worksheet_ttl seconds they are looked up again in case sheets were moved or renamed
+        cached = self.worksheets.get((key, index))
+        if cached is not None and time.monotonic() - cached[1] < self.worksheet_ttl:
+            return cached[0]
+
+        spreadsheet = self.open_by_key(key)
+        with self.lock:
+            cached = self.worksheets.get((key, index))
+            if cached is not None and time.monotonic() - cached[1] < self.worksheet_ttl:
+                return cached[0]
+            try:
+                if isinstance(index, str):
+                    worksheet = spreadsheet.worksheet(index)
+                else:
+                    worksheet = spreadsheet.get_worksheet(index)
+            except Exception as error:
+                if cached is not None:
+                    # The old handle still works for reads and writes; try again next time
+                    logger.warning("Could not look up worksheet %s again, keeping the old handle: %s", index, error)
+                    self.worksheets[(key, index)] = (cached[0], time.monotonic())
+                    return cached[0]
+                raise SheetsUnavailable(f"{type(error).__name__}: {error}") from error
+            self.worksheets[(key, index)] = (worksheet, time.monotonic())
+            return worksheet
+
+    def start_refresher(self):
+        if self.refresher is None:
+            self.refresher = threading.Thread(target=self.refresh_forever, name='sheets-token-refresh', daemon=True)
+            self.refresher.start()
+
+    def refresh_forever(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Could not refresh the Google Sheets access token")
+
+    def refresh(self):
+        # Renew the access token ahead of time so requests never wait on a token refresh; raises when Google
+        # can't be reached or turns the credentials down
+        http_client = getattr(self.client, 'http_client', self.client)
+        auth = getattr(getattr(http_client, 'session', None), 'credentials', None)
+        if auth is None or not hasattr(auth, 'refresh'):
+            return
+        auth.refresh(Request())
+        self.refreshed_at = time.time()
+
+    def health(self):
+        # Report whether Sheets can be used. Building a client makes no request, so fetching a new access token
+        # is what proves Google answers; the result is kept for health_ttl seconds to keep the check cheap
+        with self.probe_lock:
+            if self.probe is None or time.monotonic() - self.probe[0] >= self.health_ttl:
+                try:
+                    self.get_client()
+                    self.refresh()
+                    error = None
+                except SheetsUnavailable as unavailable:
+                    error = str(unavailable)
+                except Exception as failure:
+                    logger.warning("Google Sheets health check failed: %s", failure)
+                    error = f"{type(failure).__name__}: {failure}"
+                self.probe = (time.monotonic(), error)
+            error = self.probe[1]
+
+        return {
+            'connected': error is None,
+            'spreadsheets_open': len(self.spreadsheets),
+            'token_refreshed_at': self.refreshed_at,
+            'error': error,
+        }
+
+
+# Shared provider used by the apps
+sheets_clients = SheetsClientProvider(
+    credentials_file=os.getenv('GOOGLE_CREDENTIALS_FILE', 'credentials.json'),
+    refresh_interval=float(os.getenv('SHEETS_TOKEN_REFRESH', str(30 * 60))),
+    worksheet_ttl=float(os.getenv('SHEETS_WORKSHEET_TTL', str(60 * 60))),
+    health_ttl=float(os.getenv('SHEETS_HEALTH_TTL', '30')),
+)
@@ -0,0 +1,140 @@
+import math
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from search_index import search_index
+from taxonomy import (ENGAGEMENT_FORMATS, EMOTIONAL_TRIGGERS, TONES, FORMAT_LOOKUP, TRIGGER_LOOKUP, TONE_LOOKUP,
+                      canonical, is_random, resolve_conditions)
+
+# Position of every value in its list, so a combination can be stored as one number
+FORMAT_INDEX = {name: index for index, name in enumerate(ENGAGEMENT_FORMATS)}
+TRIGGER_INDEX = {name: index for index, name in enumerate(EMOTIONAL_TRIGGERS)}
+TONE_INDEX = {name: index for index, name in enumerate(TONES)}
+
+# Number of (format, trigger, tone) combinations, one bit each per topic
+COMBINATIONS = len(ENGAGEMENT_FORMATS) * len(EMOTIONAL_TRIGGERS) * len(TONES)
+
+# Fraction used to space consecutive picks evenly over the combinations (golden ratio)
+GOLDEN = (math.sqrt(5) - 1) / 2
+
+
+def combination_number(format_index, trigger_index, tone_index):
+    return (format_index * len(EMOTIONAL_TRIGGERS) + trigger_index) * len(TONES) + tone_index
+
+
+def number_at(choices, position):
+    # The combination number at `position` among the allowed choices for format, trigger and tone
+    format_position, rest = divmod(position, len(choices[1]) * len(choices[2]))
+    trigger_position, tone_position = divmod(rest, len(choices[2]))
+    return combination_number(choices[0][format_position], choices[1][trigger_position], choices[2][tone_position])
+
+
+def stride_for(size):
+    # A step close to size * golden ratio that shares no factor with size, so stepping visits every position once
+    stride = max(1, round(size * GOLDEN))
+    while math.gcd(stride, size) != 1:
+        stride += 1
+    return stride
+
+
+class CoverageScheduler:
+    def __init__(self, max_topics=5000):
+        # One bitset of used combinations per (store, topic); the least recently used topics are dropped first
+        # and marked again from the store when they come back
+        self.max_topics = max_topics
+        self.topics = OrderedDict()
+        self.lock = threading.Lock()
+
+    def entry(self, store, topic):
+        # The used-combination bitset of a topic, plus where each walk over it got to
+        key = (id(store), topic.strip().lower())
+        with self.lock:
+            entry = self.topics.get(key)
+            if entry is not None:
+                self.topics.move_to_end(key)
+                return entry
+
+        # Mark what the topic was given before, including before this process started, from the local search
+        # index (which reads only new rows from the store) and without holding the lock
+        bits = bytearray((COMBINATIONS + 7) // 8)
+        self.mark(bits, search_index.topic_rows(store, topic))
+
+        with self.lock:
+            # Another request may have marked the topic meanwhile; keep theirs, it may hold newer picks
+            entry = self.topics.setdefault(key, (bits, {}))
+            self.topics.move_to_end(key)
+            while len(self.topics) > self.max_topics:
+                self.topics.popitem(last=False)
+            return entry
+
+    @staticmethod
+    def mark(bits, rows):
+        # Replay the topic's rows in order; a round over every combination starts afresh once all were used
+        used = 0
+        for row in rows:
+            if len(row) < 4:
+                continue
+            indexes = (FORMAT_INDEX.get(row[1]), TRIGGER_INDEX.get(row[2]), TONE_INDEX.get(row[3]))
+            if None in indexes:
+                continue
+            number = combination_number(*indexes)
+            if not bits[number >> 3] & (1 << (number & 7)):
+                bits[number >> 3] |= 1 << (number & 7)
+                used += 1
+                if used == COMBINATIONS:
+                    bits[:] = bytes(len(bits))
+                    used = 0
+
+    def next_conditions(self, store, topic, engagement_format, emotional_trigger, tone):
+        # Fill every 'Random' choice with a combination this topic hasn't had yet; chosen values are kept
+        choices = []
+        for value, names, lookup, index, kind in (
+            (engagement_format, ENGAGEMENT_FORMATS, FORMAT_LOOKUP, FORMAT_INDEX, 'engagement format'),
+            (emotional_trigger, EMOTIONAL_TRIGGERS, TRIGGER_LOOKUP, TRIGGER_INDEX, 'emotional trigger'),
+            (tone, TONES, TONE_LOOKUP, TONE_INDEX, 'tone'),
+        ):
+            if is_random(value):
+                choices.append(range(len(names)))
+            else:
+                position = index.get(canonical(lookup, value, kind))
+                if position is None:
+                    # A tone only offered by the form isn't tracked; pick the rest at random
+                    return resolve_conditions(engagement_format, emotional_trigger, tone)
+                choices.append((position,))
+
+        size = len(choices[0]) * len(choices[1]) * len(choices[2])
+        bits, cursors = self.entry(store, topic)
+
+        with self.lock:
+
+            # Walk the allowed combinations in a low-discrepancy order that starts at a fixed place per topic,
+            # carrying on from where the last walk stopped, and take the first one not used yet
+            offset = zlib.crc32(topic.strip().lower().encode('utf-8')) % size
+            stride = stride_for(size)
+            walk = tuple(None if len(choice) > 1 else choice[0] for choice in choices)
+            cursor = cursors.get(walk, 0)
+            for step in range(size):
+                number = number_at(choices, (offset + (cursor + step) % size * stride) % size)
+                if not bits[number >> 3] & (1 << (number & 7)):
+                    cursors[walk] = (cursor + step + 1) % size
+                    break
+            else:
+                # Every allowed combination has been used: start a new round over them
+                for position in range(size):
+                    used = number_at(choices, position)
+                    bits[used >> 3] &= ~(1 << (used & 7))
+                cursors[walk] = 1
+                number = number_at(choices, offset)
+
+            # Claim it right away so concurrent submits for the same topic get different combinations
+            bits[number >> 3] |= 1 << (number & 7)
+
+        format_index, rest = divmod(number, len(EMOTIONAL_TRIGGERS) * len(TONES))
+        trigger_index, tone_index = divmod(rest, len(TONES))
+        return ENGAGEMENT_FORMATS[format_index], EMOTIONAL_TRIGGERS[trigger_index], TONES[tone_index]
+
+
+# Shared scheduler used by the apps and batches
+coverage_scheduler = CoverageScheduler(max_topics=int(os.getenv('COVERAGE_MAX_TOPICS', '5000')))
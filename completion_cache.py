@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (time stored, value), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+class SQLiteBackend:
+    def __init__(self, path='completion_cache.db', max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, value TEXT, stored_at REAL, used_at REAL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS completions_used_at ON completions (used_at)")
+        self.connection.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT stored_at, value FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.connection.execute("UPDATE completions SET used_at = ? WHERE key = ?", (time.time(), key))
+                self.connection.commit()
+            return row
+
+    def set(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, value, now, now))
+            # Drop the least recently used entries once the table grows past its limit
+            self.connection.execute(
+                "DELETE FROM completions WHERE key IN "
+                "(SELECT key FROM completions ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.connection.commit()
+
+    def delete(self, key):
+        with self.lock:
+            self.connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            self.connection.commit()
+
+
+class CompletionCache:
+    def __init__(self, backend, ttl=7 * 24 * 3600):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.in_flight = {}  # key -> event set once the first caller has stored the value
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(model, prompt, max_tokens):
+        return hashlib.sha256(json.dumps([model, prompt, max_tokens]).encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.time() - stored_at > self.ttl:
+            self.backend.delete(key)
+            return None
+        return value
+
+    def get_or_create(self, model, prompt, max_tokens, create):
+        key = self.key(model, prompt, max_tokens)
+        while True:
+            value = self.lookup(key)
+            if value is not None:
+                with self.lock:
+                    self.hits += 1
+                return value
+
+            with self.lock:
+                event = self.in_flight.get(key)
+                if event is None:
+                    # This caller makes the completion; identical prompts arriving meanwhile wait for it
+                    event = self.in_flight[key] = threading.Event()
+                    self.misses += 1
+                    break
+            event.wait()
+
+        try:
+            value = create()
+            self.backend.set(key, value)
+            return value
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            event.set()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+def create_backend():
+    # COMPLETION_CACHE picks where cached completions live: 'memory' (default) or 'sqlite'
+    if os.getenv('COMPLETION_CACHE', 'memory').lower() == 'sqlite':
+        return SQLiteBackend(
+            path=os.getenv('COMPLETION_CACHE_PATH', 'completion_cache.db'),
+            max_entries=int(os.getenv('COMPLETION_CACHE_SIZE', '10000')),
+        )
+    return MemoryBackend(max_entries=int(os.getenv('COMPLETION_CACHE_SIZE', '1000')))
+
+
+# Shared cache used by the apps; COMPLETION_CACHE_TTL is in seconds
+completion_cache = CompletionCache(create_backend(), ttl=float(os.getenv('COMPLETION_CACHE_TTL', str(7 * 24 * 3600))))
@@ -0,0 +1,21 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Maximum number of OpenAI calls allowed in flight at the same time (set OPENAI_CONCURRENCY=1 to run them one by one)
+max_concurrency = int(os.getenv('OPENAI_CONCURRENCY', '9'))
+
+# Shared worker pool so every request reuses the same threads instead of starting new ones
+executor = ThreadPoolExecutor(max_workers=max(max_concurrency, 1), thread_name_prefix='openai')
+
+
+def run_concurrently(calls):
+    # Run the calls one after another when concurrency is switched off
+    if max_concurrency <= 1:
+        return [call() for call in calls]
+
+    # Send every call to the pool at once, each carrying the caller's context so its timings count for the caller
+    futures = [executor.submit(contextvars.copy_context().run, call) for call in calls]
+
+    # Collect the results in the same order the calls were given; the first failure is raised
+    return [future.result() for future in futures]
@@ -0,0 +1,135 @@
+import os
+import random
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict, deque
+
+from search_index import search_index
+
+# MinHash signature length, split into LSH bands of BAND_SIZE values each. Two headlines are compared when
+# any band matches; with 16 bands of 2 that happens from a similarity of about (1/16) ** (1/2) = 0.25 on,
+# and for 99% of pairs at 0.5, so near-duplicates around DEDUP_THRESHOLD are not missed
+SIGNATURE_SIZE = 32
+BAND_SIZE = 2
+
+# Large prime for the hash family, and the fixed (a, b) pairs that make up the family
+PRIME = (1 << 61) - 1
+_rng = random.Random(1234)
+HASH_PARAMS = [(_rng.randrange(1, PRIME), _rng.randrange(0, PRIME)) for _ in range(SIGNATURE_SIZE)]
+
+
+def normalize(headline):
+    # Compare words only: no emojis, punctuation, case or extra spaces
+    return ' '.join(re.sub(r'[^\w\s]', ' ', headline.lower()).split())
+
+
+def shingles(headline):
+    # Words and word pairs; headlines are short, so this is enough to tell rewordings from new ideas
+    words = normalize(headline).split() or ['']
+    pairs = [f"{first} {second}" for first, second in zip(words, words[1:])]
+    return {zlib.crc32(shingle.encode('utf-8')) for shingle in words + pairs}
+
+
+def signature(headline):
+    values = shingles(headline)
+    return array('Q', [min([(a * value + b) % PRIME for value in values]) for a, b in HASH_PARAMS])
+
+
+def similarity(first, second):
+    # Share of matching MinHash values, an estimate of the Jaccard similarity of the shingle sets
+    return sum(1 for x, y in zip(first, second) if x == y) / SIGNATURE_SIZE
+
+
+class TopicIndex:
+    __slots__ = ('signatures', 'buckets')
+
+    def __init__(self, max_headlines):
+        self.signatures = deque(maxlen=max_headlines)
+        self.buckets = {}  # (band, band values) -> signatures in that bucket
+
+    def add(self, headline_signature):
+        if len(self.signatures) == self.signatures.maxlen:
+            self.forget(self.signatures[0])
+        self.signatures.append(headline_signature)
+        for key in self.band_keys(headline_signature):
+            self.buckets.setdefault(key, []).append(headline_signature)
+
+    def forget(self, old_signature):
+        for key in self.band_keys(old_signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.remove(old_signature)
+                if not bucket:
+                    del self.buckets[key]
+
+    @staticmethod
+    def band_keys(headline_signature):
+        for start in range(0, SIGNATURE_SIZE, BAND_SIZE):
+            yield start, tuple(headline_signature[start:start + BAND_SIZE])
+
+    def most_similar(self, headline_signature):
+        # Only headlines sharing at least one band are compared, so a check stays fast however many there are
+        best = 0.0
+        for key in self.band_keys(headline_signature):
+            for candidate in self.buckets.get(key, ()):
+                best = max(best, similarity(headline_signature, candidate))
+        return best
+
+
+class HeadlineIndex:
+    def __init__(self, threshold=0.5, max_topics=2000, max_headlines=500):
+        # Memory stays bounded: at most max_headlines signatures per topic and max_topics topics.
+        # A topic dropped from memory is read back from the store the next time it comes up
+        self.threshold = threshold
+        self.max_topics = max_topics
+        self.max_headlines = max_headlines
+        self.topics = OrderedDict()  # (store, topic) -> TopicIndex, least recently used first
+        self.lock = threading.Lock()
+
+    def topic_index(self, store, topic):
+        key = (id(store), topic.strip().lower())
+        with self.lock:
+            index = self.topics.get(key)
+            if index is not None:
+                self.topics.move_to_end(key)
+                return index
+
+        # Index the topic's latest headlines from the store, so ones written before this process started
+        # (or before the topic was last dropped) count too. They come from the local search index, which reads
+        # only new rows from the store, and without holding the lock
+        index = TopicIndex(self.max_headlines)
+        for row in search_index.topic_rows(store, topic, self.max_headlines):
+            if len(row) >= 5 and row[4].strip():
+                index.add(signature(row[4]))
+
+        with self.lock:
+            # Another request may have indexed the topic meanwhile; keep theirs, it may hold newer headlines
+            index = self.topics.setdefault(key, index)
+            self.topics.move_to_end(key)
+            while len(self.topics) > self.max_topics:
+                self.topics.popitem(last=False)
+            return index
+
+    def unique_rows(self, store, rows):
+        # Keep the rows whose headline isn't a near-duplicate of an earlier one for the same topic
+        # (including the rows before it in this list), and remember the ones kept
+        kept = []
+        for row in rows:
+            headline_signature = signature(row[4])
+            index = self.topic_index(store, row[0])
+            with self.lock:
+                if index.most_similar(headline_signature) >= self.threshold:
+                    continue
+                index.add(headline_signature)
+            kept.append(row)
+        return kept
+
+
+# Shared index used by the apps and batches; DEDUP_THRESHOLD is the similarity (0-1) counted as a duplicate
+headline_index = HeadlineIndex(
+    threshold=float(os.getenv('DEDUP_THRESHOLD', '0.5')),
+    max_topics=int(os.getenv('DEDUP_MAX_TOPICS', '2000')),
+    max_headlines=int(os.getenv('DEDUP_MAX_HEADLINES', '500')),
+)
@@ -0,0 +1,160 @@
+import re
+from functools import lru_cache
+
+# Define a dictionary to map engagement formats to emojis
+FORMAT_EMOJIS = {
+    'Call to Action': '📢',
+    'Clickbait': '🔥',
+    'Innovation Driving Cost Benefit': '💰',
+    'Missed Opportunity Awareness': '⚠️',
+    'Offer Announcement + Call to Action': '🎁',
+    'Offer Announcement + Inclusivity': '🤝',
+    'Price Discovery': '💲',
+    'Prices May Surprise You': '😲',
+    'Problem Statement + Solution': '🔍💡',
+    'Provocative Questioning': '❓',
+    'Question': '❓',
+    'Question + Call to Action': '❓📢',
+    'Question + Problem Statement + Solution': '❓🔍💡',
+    'Question + Solution': '❓💡',
+    'Search Call to Action': '🔍📢',
+    'Statement': '💬',
+    'Statement + Call to Action': '💬📢',
+    'Statement + Expectation Challenge': '💪',
+    'Statement Regarding Health Symptoms': '🩺',
+    'Statistics Based': '📊',
+    'Topic Introduction': '🌟',
+    'Offer Announcement + Exclusivity': '🔒🎁',
+    'Fear of Missing Out': '😱',
+    'Tactics to Try Tonight': '🌙',
+    'Question + Urgency': '❓⌛',
+    'Question + Offer': '❓🎁',
+    'How To': '🔧',
+    'How To + Treatments': '🔧💊',
+    'Seniors Have Been Experiencing': '👴👵',
+    'List of Symptoms': '🤒',
+    'Deals': '💼'
+}
+
+# Emojis for emotional triggers, used when the engagement format has none
+TRIGGER_EMOJIS = {
+    'Adventure': '🧭',
+    'Affinity': '🤝',
+    'Affordability': '💲',
+    'Ambition': '🚀',
+    'Anger': '😠',
+    'Anticipation': '⏳',
+    'Convenience': '👌',
+    'Cost Sensitivity': '💲',
+    'Curiosity': '🤔',
+    'Danger': '⚠️',
+    'Discovery': '🔍',
+    'Easy Accessibility': '🔓',
+    'Empowerment': '💪',
+    'Envy': '😒',
+    'Fear of Ignoring Health Symptoms': '🩺',
+    'Fear of Missing Information': 'ℹ️',
+    'Fear of Missing Out': '😱',
+    'Fear of Old Age': '👴',
+    'Fear of Potential Health Issue': '🩺',
+    'Financial Gain': '💰',
+    'Greed': '🤑',
+    'Hope': '🌈',
+    'Hop and Affordability': '🌈',
+    'Improve Compensation Level': '📈',
+    'Improve Financial Situation': '📈',
+    'Improve Quality of Life': '🌟',
+    'Localization': '📍',
+    'Love': '❤️',
+    'Nostalgia': '📻',
+    'Not Too Late': '⏰',
+    'Opportunity': '🚪',
+    'Optimism': '☀️',
+    'Relief': '😌',
+    'Savings': '💰',
+    'Scarcity': '⏳',
+    'Security': '🔒',
+    'Surprise': '😲',
+    'Timeliness': '⏰',
+    'Transparency': '🔎',
+    'Trust': '🤝',
+    'Urgency': '⌛',
+    'Validation': '✅',
+    'Vanity': '💅'
+}
+
+# Emojis for tones, the last resort
+TONE_EMOJIS = {
+    'Happy': '😊',
+    'Excited': '🎉',
+    'Sad': '😢',
+    'Anxious': '😟',
+    'Calm': '😌',
+    'Passionate': '🔥',
+    'Serious': '📌',
+    'Humorous': '😂',
+    'Ironic': '🙃',
+    'Inspiring': '✨',
+    'Empathetic': '🤗',
+    'Formal': '📝',
+    'Casual': '👋',
+    'Optimistic': '☀️',
+    'Pessimistic': '🌧️',
+    'Fearful': '😨',
+    'Nostalgic': '📻',
+    'Affectionate': '💕',
+    'Sympathetic': '🤗',
+    'Curious': '🤔',
+    'Energetic': '⚡',
+    'Indifferent': '😐',
+    'Confident': '😎',
+    'Surprised': '😲',
+    'Angry': '😠',
+    'Suspenseful': '😬',
+    'Mysterious': '🕵️',
+    'Hopeful': '🌈',
+    'Gloomy': '☁️',
+    'Skeptical': '🤨',
+    'Friendly': '😊',
+    'Professional': '💼',
+    'Inquisitive': '🤔',
+    'Informative': 'ℹ️',
+    'Persuasive': '👉',
+    'Sarcastic': '🙃',
+    'Enthusiastic': '🎉',
+    'Conversational': '💬',
+    'Instructional': '📋',
+    'Promotional': '📣'
+}
+
+# Words in a headline that call for a more specific emoji than the format's
+KEYWORD_EMOJIS = {
+    'save': '💰', 'savings': '💰', 'money': '💰', 'cash': '💵', 'cheap': '💲', 'price': '💲', 'prices': '💲',
+    'cost': '💲', 'costs': '💲', 'deal': '🏷️', 'deals': '🏷️', 'discount': '🏷️', 'sale': '🏷️', 'free': '🎁',
+    'offer': '🎁', 'gift': '🎁', 'health': '🩺', 'doctor': '🩺', 'symptoms': '🤒', 'pain': '🤕',
+    'treatment': '💊', 'treatments': '💊', 'medicine': '💊', 'senior': '👵', 'seniors': '👵', 'retirement': '🏖️',
+    'home': '🏠', 'house': '🏠', 'car': '🚗', 'cars': '🚗', 'travel': '✈️', 'vacation': '🏖️', 'job': '💼',
+    'jobs': '💼', 'career': '💼', 'insurance': '🛡️', 'loan': '🏦', 'loans': '🏦', 'credit': '💳', 'phone': '📱',
+    'phones': '📱', 'internet': '🌐', 'food': '🍽️', 'diet': '🥗', 'weight': '⚖️', 'sleep': '😴', 'pet': '🐾',
+    'pets': '🐾', 'dog': '🐶', 'dogs': '🐶', 'cat': '🐱', 'cats': '🐱', 'school': '🎓', 'degree': '🎓',
+    'solar': '☀️', 'energy': '⚡', 'tonight': '🌙', 'today': '📅', 'now': '⏰', 'secret': '🤫', 'new': '🆕',
+}
+
+# One compiled pattern for every keyword, so a headline is scanned once
+KEYWORD_PATTERN = re.compile(r'\b(' + '|'.join(sorted(map(re.escape, KEYWORD_EMOJIS), key=len, reverse=True)) + r')\b',
+                             re.IGNORECASE)
+
+
+@lru_cache(maxsize=4096)
+def combination_emoji(engagement_format, emotional_trigger, tone):
+    # The emoji for a (format, trigger, tone) combination: the format's, then the trigger's, then the tone's
+    return FORMAT_EMOJIS.get(engagement_format) or TRIGGER_EMOJIS.get(emotional_trigger) or TONE_EMOJIS.get(tone, '')
+
+
+def pick_emoji(headline, engagement_format, emotional_trigger, tone):
+    # Pick an emoji for a headline without asking the model: a keyword in the headline wins,
+    # otherwise the emoji for its format, trigger and tone
+    match = KEYWORD_PATTERN.search(headline)
+    if match:
+        return KEYWORD_EMOJIS[match.group(1).lower()]
+    return combination_emoji(engagement_format, emotional_trigger, tone)
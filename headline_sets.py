@@ -0,0 +1,85 @@
+import json
+import os
+import re
+
+# Number of headlines made per submit
+HEADLINE_COUNT = int(os.getenv('HEADLINE_COUNT', '3'))
+
+# 'single' asks for every headline and the description in one completion, 'separate' makes one call per item
+GENERATION_MODE = os.getenv('GENERATION_MODE', 'single').lower()
+
+# Where the headlines array starts, and one string in it, possibly not finished yet
+HEADLINES_START = re.compile(r'"headlines"\s*:\s*\[')
+STRING_PART = re.compile(r'\s*,?\s*"((?:[^"\\]|\\.)*)("?)')
+# The end of an escape that hasn't fully arrived yet, such as '\' or '\u00'
+UNFINISHED_ESCAPE = re.compile(r'\\(u[0-9a-fA-F]{0,3})?$')
+
+
+def partial_headlines(text):
+    # The headlines of a JSON answer that is still arriving, the last one possibly cut short
+    start = HEADLINES_START.search(text)
+    if start is None:
+        return []
+
+    headlines = []
+    position = start.end()
+    while True:
+        match = STRING_PART.match(text, position)
+        if match is None:
+            break
+        content, closed = match.groups()
+        if not closed:
+            content = UNFINISHED_ESCAPE.sub('', content)
+        try:
+            headlines.append(json.loads(f'"{content}"'))
+        except ValueError:
+            break
+        if not closed:
+            break
+        position = match.end()
+    return headlines
+
+
+class HeadlineSetStream:
+    def __init__(self, on_piece):
+        # Pass on_piece(number, text) every new piece of every headline while the JSON answer streams in
+        self.on_piece = on_piece
+        self.text = ''
+        self.sent = []  # text of every headline passed on so far
+
+    def feed(self, piece):
+        self.text += piece
+        for number, headline in enumerate(partial_headlines(self.text)):
+            if number == len(self.sent):
+                self.sent.append('')
+            if len(headline) > len(self.sent[number]) and headline.startswith(self.sent[number]):
+                self.on_piece(number, headline[len(self.sent[number]):])
+                self.sent[number] = headline
+
+
+def parse_headline_set(text, count):
+    # Return (headlines, description) from the model's JSON answer; raise ValueError if it doesn't fit
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if match is None:
+        raise ValueError("No JSON object in the response")
+
+    try:
+        data = json.loads(match.group(0))
+    except json.JSONDecodeError as error:
+        raise ValueError(f"Invalid JSON in the response: {error}") from error
+
+    items = data.get('headlines') if isinstance(data, dict) else None
+    description = data.get('description') if isinstance(data, dict) else None
+    if not isinstance(items, list) or len(items) < count:
+        raise ValueError(f"Expected {count} headlines")
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError("Missing description")
+
+    headlines = []
+    for item in items[:count]:
+        if not isinstance(item, str) or not item.strip():
+            raise ValueError("Expected every headline to be a non-empty string")
+        headlines.append(item.strip())
+
+    # Make sure the description is 30 words or less
+    return headlines, ' '.join(description.strip().split()[:30])
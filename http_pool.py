@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class PoolStats:
+    def __init__(self):
+        # How often a request found an open connection, and how long it waited for one
+        self.checkouts = 0
+        self.new_connections = 0
+        self.wait_seconds = 0.0
+        self.longest_wait = 0.0
+        self.lock = threading.Lock()
+
+    def checked_out(self, waited):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds += waited
+            self.longest_wait = max(self.longest_wait, waited)
+
+    def connected(self):
+        with self.lock:
+            self.new_connections += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.checkouts,
+                'new_connections': self.new_connections,
+                'reuse_ratio': round(1 - self.new_connections / self.checkouts, 4) if self.checkouts else None,
+                'wait_seconds': round(self.wait_seconds, 6),
+                'longest_wait_seconds': round(self.longest_wait, 6),
+            }
+
+
+def counted_pool(pool_class, stats):
+    # A connection pool class that reports every checkout and every fresh connection to `stats`
+    class CountedPool(pool_class):
+        def _get_conn(self, timeout=None):
+            started = time.perf_counter()
+            connection = super()._get_conn(timeout)
+            stats.checked_out(time.perf_counter() - started)
+            return connection
+
+        def _new_conn(self):
+            stats.connected()
+            return super()._new_conn()
+
+    return CountedPool
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, stats, pool_size=16, block=True):
+        # Up to `pool_size` kept-alive connections per host; with `block` a busy pool makes callers wait
+        # for a free connection rather than opening extra ones that are thrown away afterwards
+        self.stats = stats
+        super().__init__(pool_connections=4, pool_maxsize=pool_size, pool_block=block)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': counted_pool(HTTPConnectionPool, self.stats),
+            'https': counted_pool(HTTPSConnectionPool, self.stats),
+        }
+
+    def close(self):
+        # The pool lives as long as the process; clients that close their session now and then
+        # (openai renews its session every few minutes) would otherwise drop every open connection
+        pass
+
+
+class SessionPools:
+    def __init__(self, pool_size=16, block=True):
+        self.pool_size = pool_size
+        self.block = block
+        self.stats = {}  # name -> PoolStats
+        self.lock = threading.Lock()
+
+    def session(self, name, session=None):
+        # Mount a pooled adapter on `session` (a new requests.Session by default) and keep its stats under `name`
+        session = session if session is not None else requests.Session()
+        with self.lock:
+            stats = self.stats.setdefault(name, PoolStats())
+        adapter = PooledAdapter(stats, self.pool_size, self.block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def snapshot(self):
+        with self.lock:
+            pools = dict(self.stats)
+        return {name: stats.snapshot() for name, stats in pools.items()}
+
+
+# Shared pools for the OpenAI and Google Sheets sessions; HTTP_POOL_SIZE should cover OPENAI_CONCURRENCY
+session_pools = SessionPools(
+    pool_size=int(os.getenv('HTTP_POOL_SIZE', '16')),
+    block=os.getenv('HTTP_POOL_BLOCK', '1') != '0',
+)
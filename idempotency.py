@@ -0,0 +1,86 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SubmitInProgress(Exception):
+    pass
+
+
+class SubmitLedger:
+    def __init__(self, path='idempotency.db', ttl=24 * 60 * 60, lease=300, wait=120):
+        # Every keyed submit moves through running -> staged (rows generated, not yet written) -> done.
+        # `lease` is how long a worker may hold a submit before another one takes it over,
+        # `wait` how long a repeated submit waits for the first one to finish, `ttl` how long results are kept
+        self.ttl = ttl
+        self.lease = lease
+        self.wait = wait
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS submits (key TEXT PRIMARY KEY, status TEXT NOT NULL, rows TEXT, "
+            "result TEXT, claimed_at REAL, created_at REAL)"
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+
+    def begin(self, key):
+        # Claim a submit. Returns ('new', None) when it has to be generated, ('staged', rows) when its rows
+        # were generated but not confirmed written, or ('done', (rows, result)) when it already finished
+        deadline = time.monotonic() + self.wait
+        while True:
+            with self.lock:
+                now = time.time()
+                self.connection.execute("DELETE FROM submits WHERE created_at < ?", (now - self.ttl,))
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO submits VALUES (?, 'running', NULL, NULL, ?, ?)", (key, now, now))
+                self.connection.commit()
+                if cursor.rowcount == 1:
+                    return 'new', None
+
+                status, rows, result, claimed_at = self.connection.execute(
+                    "SELECT status, rows, result, claimed_at FROM submits WHERE key = ?", (key,)).fetchone()
+                if status == 'done':
+                    return 'done', (json.loads(rows), result)
+
+                # Take over a submit whose worker let go of it or went away
+                if claimed_at < now - self.lease:
+                    cursor = self.connection.execute(
+                        "UPDATE submits SET claimed_at = ? WHERE key = ? AND claimed_at = ?", (now, key, claimed_at))
+                    self.connection.commit()
+                    if cursor.rowcount == 1:
+                        return ('staged', json.loads(rows)) if status == 'staged' else ('new', None)
+
+            if time.monotonic() > deadline:
+                raise SubmitInProgress("This submit is still being generated, please try again shortly.")
+            time.sleep(0.2)
+
+    def stage(self, key, rows):
+        # The rows are generated; a retry from here on only has to write them
+        self.update("UPDATE submits SET status = 'staged', rows = ?, claimed_at = ? WHERE key = ?",
+                    (json.dumps(rows), time.time(), key))
+
+    def finish(self, key, rows, result):
+        self.update("UPDATE submits SET status = 'done', rows = ?, result = ? WHERE key = ?",
+                    (json.dumps(rows), result, key))
+
+    def release(self, key):
+        # Let the next retry pick the submit up straight away, keeping any staged rows
+        self.update("UPDATE submits SET claimed_at = 0 WHERE key = ?", (key,))
+
+    def abandon(self, key):
+        # Nothing was kept, so the next retry starts from scratch
+        self.update("DELETE FROM submits WHERE key = ? AND status = 'running'", (key,))
+
+    def update(self, statement, parameters):
+        with self.lock:
+            self.connection.execute(statement, parameters)
+            self.connection.commit()
+
+
+# Shared ledger used by the apps; IDEMPOTENCY_TTL is in seconds
+submit_ledger = SubmitLedger(
+    path=os.getenv('IDEMPOTENCY_DB', 'idempotency.db'),
+    ttl=float(os.getenv('IDEMPOTENCY_TTL', str(24 * 60 * 60))),
+)
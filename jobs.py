@@ -0,0 +1,134 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class JobEvents:
+    def __init__(self):
+        # Everything a streamed job reported so far, kept so a page that starts listening late still sees all of it
+        self.events = []  # (kind, number, value)
+        self.condition = threading.Condition()
+
+    def put(self, kind, number, value):
+        with self.condition:
+            self.events.append((kind, number, value))
+            self.condition.notify_all()
+
+    def read(self, start, timeout):
+        # The events after the first `start`, waiting up to `timeout` seconds for one when there are none yet
+        with self.condition:
+            self.condition.wait_for(lambda: len(self.events) > start, timeout)
+            return self.events[start:]
+
+
+class JobQueue:
+    def __init__(self, workers=4, max_depth=20, keep=1000):
+        # Jobs wait in a bounded queue so a burst of submits can't pile up without limit
+        self.queue = queue.Queue(maxsize=max_depth)
+        self.workers = workers
+        self.keep = keep
+        self.jobs = OrderedDict()  # job id -> job status, oldest first
+        self.events = {}  # job id -> JobEvents of a streamed job
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def start(self):
+        # Start the worker threads the first time a job is submitted
+        with self.lock:
+            if self.threads:
+                return
+            for number in range(self.workers):
+                thread = threading.Thread(target=self.work, name=f"job-worker-{number}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        # Returns the new job id, or raises queue.Full when the queue is at its limit
+        return self.enqueue(func, args, kwargs, None)
+
+    def submit_streamed(self, func, *args, **kwargs):
+        # Like submit, with func also given on_event(kind, number, value); what it reports, and then 'done' or
+        # 'failed', can be read back with job_events(job_id)
+        events = JobEvents()
+        return self.enqueue(func, args, dict(kwargs, on_event=events.put), events)
+
+    def enqueue(self, func, args, kwargs, events):
+        self.start()
+        job_id = uuid.uuid4().hex
+        job = {'id': job_id, 'status': 'queued', 'result': None, 'error': None,
+               'submitted_at': time.time(), 'started_at': None, 'finished_at': None}
+
+        with self.lock:
+            self.jobs[job_id] = job
+            if events is not None:
+                self.events[job_id] = events
+            # Forget the oldest jobs once too many are kept around
+            while len(self.jobs) > self.keep:
+                old_id, _ = self.jobs.popitem(last=False)
+                self.events.pop(old_id, None)
+
+        try:
+            self.queue.put_nowait((job_id, func, args, kwargs))
+        except queue.Full:
+            with self.lock:
+                self.jobs.pop(job_id, None)
+                self.events.pop(job_id, None)
+            raise
+        return job_id
+
+    def job_events(self, job_id):
+        with self.lock:
+            return self.events.get(job_id)
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job = dict(job)
+
+        # Tell waiting users how many jobs are ahead of them
+        if job['status'] == 'queued':
+            job['position'] = self.position(job_id)
+        return job
+
+    def position(self, job_id):
+        with self.queue.mutex:
+            waiting = [item[0] for item in self.queue.queue]
+        return waiting.index(job_id) + 1 if job_id in waiting else 0
+
+    def update(self, job_id, **changes):
+        with self.lock:
+            if job_id in self.jobs:
+                self.jobs[job_id].update(changes)
+
+    def work(self):
+        while True:
+            job_id, func, args, kwargs = self.queue.get()
+            events = self.job_events(job_id)
+            self.update(job_id, status='running', started_at=time.time())
+            try:
+                result = func(*args, **kwargs)
+                self.update(job_id, status='done', result=result, finished_at=time.time())
+                if events is not None:
+                    events.put('done', None, result)
+            except Exception as error:
+                logger.exception("Job %s failed", job_id)
+                self.update(job_id, status='failed', error=str(error), finished_at=time.time())
+                if events is not None:
+                    events.put('failed', None, str(error))
+            finally:
+                self.queue.task_done()
+
+
+# Shared queue used by the apps; JOB_WORKERS sets how many submits are generated at once
+job_queue = JobQueue(
+    workers=int(os.getenv('JOB_WORKERS', '4')),
+    max_depth=int(os.getenv('JOB_QUEUE_DEPTH', '20')),
+)
@@ -0,0 +1,177 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the stage duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Dollars per 1000 prompt and completion tokens
+MODEL_PRICES = {
+    'gpt-3.5-turbo': (0.0015, 0.002),
+    'text-davinci-003': (0.02, 0.02),
+}
+
+# What every counter counts, for the '# HELP' lines
+COUNTER_HELP = {
+    'openai_requests_total': 'OpenAI calls, by model and outcome.',
+    'openai_tokens_total': 'OpenAI tokens sent (in) and received (out), by model.',
+    'openai_cost_dollars_total': 'Estimated OpenAI cost in dollars, by model.',
+    'openai_retries_total': 'Retried attempts of OpenAI calls, by model.',
+}
+
+# The request being handled in this thread (or in threads started for it), if it is being traced
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Trace:
+    def __init__(self, name, fields):
+        # Everything one request spent, written out as a single log line when it ends
+        self.name = name
+        self.fields = fields
+        self.stages = defaultdict(float)
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cost = 0.0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+
+class Metrics:
+    def __init__(self, log_requests=True):
+        self.log_requests = log_requests
+        self.durations = {}  # (pipeline, stage) -> [bucket counts..., count, sum]
+        self.counters = defaultdict(float)  # (metric name, labels) -> value
+        self.lock = threading.Lock()
+
+    def stage(self, stage, pipeline=''):
+        # Time a block as one stage of the current request
+        return StageTimer(self, stage, pipeline)
+
+    def observe(self, stage, pipeline, seconds):
+        with self.lock:
+            histogram = self.durations.get((pipeline, stage))
+            if histogram is None:
+                histogram = self.durations[(pipeline, stage)] = [0] * (len(BUCKETS) + 2)
+            for number, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[number] += 1
+            histogram[-2] += 1
+            histogram[-1] += seconds
+
+        trace = current_trace.get()
+        if trace is not None:
+            with trace.lock:
+                trace.stages[stage] += seconds
+
+    def record_openai(self, model, tokens_in, tokens_out, retries, outcome):
+        # Count one OpenAI call, what it used and what it cost
+        with self.lock:
+            self.counters[('openai_requests_total', (('model', model), ('outcome', outcome)))] += 1
+            self.counters[('openai_retries_total', (('model', model),))] += retries
+
+        trace = current_trace.get()
+        if trace is not None:
+            with trace.lock:
+                trace.retries += retries
+        self.record_tokens(model, tokens_in, tokens_out)
+
+    def record_tokens(self, model, tokens_in, tokens_out):
+        # Count tokens and what they cost; a streamed reply reports no usage, so its caller counts it once read
+        prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+        cost = (tokens_in * prompt_price + tokens_out * completion_price) / 1000
+        with self.lock:
+            self.counters[('openai_tokens_total', (('model', model), ('direction', 'in')))] += tokens_in
+            self.counters[('openai_tokens_total', (('model', model), ('direction', 'out')))] += tokens_out
+            self.counters[('openai_cost_dollars_total', (('model', model),))] += cost
+
+        trace = current_trace.get()
+        if trace is not None:
+            with trace.lock:
+                trace.tokens_in += tokens_in
+                trace.tokens_out += tokens_out
+                trace.cost += cost
+
+    def request(self, name, **fields):
+        # Trace a request; the calls it makes, in this thread or the shared pools, add to its log line
+        return RequestTracer(self, name, fields)
+
+    def render(self):
+        # Everything collected so far in the Prometheus text format
+        with self.lock:
+            durations = {key: list(histogram) for key, histogram in self.durations.items()}
+            counters = dict(self.counters)
+
+        lines = [
+            '# HELP headlines_stage_seconds Time spent in each stage of headline generation.',
+            '# TYPE headlines_stage_seconds histogram',
+        ]
+        for (pipeline, stage), histogram in sorted(durations.items()):
+            labels = f'pipeline="{pipeline}",stage="{stage}"'
+            for bound, count in zip(BUCKETS, histogram):
+                lines.append(f'headlines_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'headlines_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram[-2]}')
+            lines.append(f'headlines_stage_seconds_count{{{labels}}} {histogram[-2]}')
+            lines.append(f'headlines_stage_seconds_sum{{{labels}}} {histogram[-1]:.6f}')
+
+        described = set()
+        for (name, labels), value in sorted(counters.items()):
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {COUNTER_HELP[name]}')
+                lines.append(f'# TYPE {name} counter')
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+            # Full precision, so large counters still go up by every token and rate() stays smooth
+            lines.append(f'{name}{{{label_text}}} {float(value)!r}')
+        return '\n'.join(lines) + '\n'
+
+
+class StageTimer:
+    def __init__(self, metrics, stage, pipeline):
+        self.metrics = metrics
+        self.stage = stage
+        self.pipeline = pipeline
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.metrics.observe(self.stage, self.pipeline, time.perf_counter() - self.started)
+
+
+class RequestTracer:
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.trace = Trace(name, fields)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.token = current_trace.set(self.trace)
+        return self.trace
+
+    def __exit__(self, error_type, error, traceback):
+        current_trace.reset(self.token)
+        if not self.metrics.log_requests:
+            return
+        trace = self.trace
+        logger.info(json.dumps({
+            'request': trace.name,
+            **trace.fields,
+            'status': 'failed' if error_type else 'ok',
+            'seconds': round(time.perf_counter() - self.started, 4),
+            'stages': {stage: round(seconds, 4) for stage, seconds in trace.stages.items()},
+            'tokens_in': trace.tokens_in,
+            'tokens_out': trace.tokens_out,
+            'cost_dollars': round(trace.cost, 6),
+            'retries': trace.retries,
+        }))
+
+
+# Shared metrics for the apps; METRICS_LOG_REQUESTS=0 turns the per-request log lines off
+metrics = Metrics(log_requests=os.getenv('METRICS_LOG_REQUESTS', '1') != '0')
@@ -0,0 +1,177 @@
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import openai
+
+from http_pool import session_pools
+from metrics import metrics
+from prompts import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Errors worth trying again after a pause
+RETRY_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+
+def retryable(error):
+    # Other API errors are only worth retrying when the server side failed
+    if isinstance(error, RETRY_ERRORS):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class SharedLimits:
+    def __init__(self, path='openai_limits.db', requests_per_minute=3000, tokens_per_minute=90000,
+                 failure_threshold=5, open_seconds=30):
+        # Buckets and breaker live in a SQLite file so every worker thread and process draws from the same budget
+        self.path = path
+        self.capacity = {'requests': requests_per_minute, 'tokens': tokens_per_minute}
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.local = threading.local()
+        with self.transaction() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, level REAL, updated REAL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS breaker (name TEXT PRIMARY KEY, failures INTEGER, open_until REAL)")
+            connection.execute("INSERT OR IGNORE INTO breaker VALUES ('openai', 0, 0)")
+            for name, capacity in self.capacity.items():
+                connection.execute("INSERT OR IGNORE INTO buckets VALUES (?, ?, ?)", (name, capacity, time.time()))
+
+    def connection(self):
+        # One connection per thread; the file lock taken by BEGIN IMMEDIATE keeps processes in step
+        if not hasattr(self.local, 'connection'):
+            self.local.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        return self.local.connection
+
+    def transaction(self):
+        limits = self
+
+        class Transaction:
+            def __enter__(self):
+                self.connection = limits.connection()
+                self.connection.execute("BEGIN IMMEDIATE")
+                return self.connection
+
+            def __exit__(self, error_type, error, traceback):
+                self.connection.execute("ROLLBACK" if error_type else "COMMIT")
+
+        return Transaction()
+
+    def acquire(self, tokens):
+        # Wait until both the request and the token bucket can cover this call, then take from them
+        needed = {'requests': 1, 'tokens': min(tokens, self.capacity['tokens'])}
+        while True:
+            with self.transaction() as connection:
+                now = time.time()
+                open_until = connection.execute("SELECT open_until FROM breaker WHERE name = 'openai'").fetchone()[0]
+                if open_until > now:
+                    raise CircuitOpen(f"OpenAI calls are paused for {open_until - now:.0f}s after repeated failures")
+
+                wait = 0.0
+                levels = {}
+                for name, capacity in self.capacity.items():
+                    level, updated = connection.execute(
+                        "SELECT level, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                    # Refill at capacity per minute, never above capacity
+                    levels[name] = min(capacity, level + (now - updated) * capacity / 60)
+                    if levels[name] < needed[name]:
+                        wait = max(wait, (needed[name] - levels[name]) * 60 / capacity)
+
+                if wait == 0:
+                    for name in self.capacity:
+                        connection.execute("UPDATE buckets SET level = ?, updated = ? WHERE name = ?",
+                                           (levels[name] - needed[name], now, name))
+                    return
+            time.sleep(min(wait, 1.0))
+
+    def succeeded(self):
+        with self.transaction() as connection:
+            connection.execute("UPDATE breaker SET failures = 0 WHERE name = 'openai'")
+
+    def failed(self):
+        # Open the breaker once enough calls in a row have failed
+        with self.transaction() as connection:
+            failures = connection.execute("SELECT failures FROM breaker WHERE name = 'openai'").fetchone()[0] + 1
+            open_until = time.time() + self.open_seconds if failures >= self.failure_threshold else 0
+            connection.execute("UPDATE breaker SET failures = ?, open_until = ? WHERE name = 'openai'",
+                               (0 if open_until else failures, open_until))
+
+
+class OpenAIClient:
+    def __init__(self, limits, timeout=30, max_retries=4, backoff=1.0):
+        self.limits = limits
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    @staticmethod
+    def estimate_tokens(kwargs):
+        # Tokens in the prompt, plus everything the reply may use
+        if 'messages' in kwargs:
+            text = ''.join(message['content'] for message in kwargs['messages'])
+        else:
+            text = kwargs.get('prompt', '')
+        return count_tokens(text) + kwargs.get('max_tokens', 16)
+
+    def create(self, api, **kwargs):
+        # Call api.create (openai.ChatCompletion or openai.Completion) within the shared limits,
+        # with a timeout on every attempt and jittered exponential backoff between attempts
+        kwargs.setdefault('request_timeout', self.timeout)
+        tokens = self.estimate_tokens(kwargs)
+        model = kwargs.get('model') or kwargs.get('engine')
+        for attempt in range(self.max_retries + 1):
+            self.limits.acquire(tokens)
+            try:
+                response = api.create(**kwargs)
+            except openai.error.OpenAIError as error:
+                if retryable(error):
+                    self.limits.failed()
+                if not retryable(error) or attempt == self.max_retries:
+                    metrics.record_openai(model, 0, 0, attempt, 'failed')
+                    raise
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+                logger.warning("OpenAI call failed (%s), retrying in %.1fs", type(error).__name__, delay)
+                time.sleep(delay)
+            else:
+                self.limits.succeeded()
+                # Streamed replies carry no usage, so only their prompt is counted here, from the estimate;
+                # Pipeline.complete counts the reply once it has read it
+                usage = getattr(response, 'usage', None) or {}
+                metrics.record_openai(model, usage.get('prompt_tokens', tokens - kwargs.get('max_tokens', 16)),
+                                      usage.get('completion_tokens', 0), attempt, 'ok')
+                return response
+
+    def chat_completion(self, **kwargs):
+        return self.create(openai.ChatCompletion, **kwargs)
+
+    def completion(self, **kwargs):
+        return self.create(openai.Completion, **kwargs)
+
+
+# Every OpenAI call goes over the same kept-alive connections instead of one session per thread
+openai.requestssession = session_pools.session('openai')
+
+# Shared client used by the apps; the limits match the account's requests and tokens per minute
+openai_client = OpenAIClient(
+    SharedLimits(
+        path=os.getenv('OPENAI_LIMITS_DB', 'openai_limits.db'),
+        requests_per_minute=int(os.getenv('OPENAI_RPM', '3000')),
+        tokens_per_minute=int(os.getenv('OPENAI_TPM', '90000')),
+    ),
+    timeout=float(os.getenv('OPENAI_TIMEOUT', '30')),
+    max_retries=int(os.getenv('OPENAI_MAX_RETRIES', '4')),
+)
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+from storage import add_write_listener
+from tenants import tenant_registry
+
+
+class CachedPage:
+    def __init__(self, body, version):
+        self.body = body
+        self.etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        self.last_modified = int(time.time())
+        self.version = version
+        self.stored_at = time.monotonic()
+
+
+class PageCache:
+    def __init__(self, size=256, ttl=60):
+        # Rendered GET pages by path; pages showing rows also expire after `ttl` seconds, so rows written
+        # by another process or straight into the sheet still show up
+        self.size = size
+        self.ttl = ttl
+        self.pages = OrderedDict()  # full path -> CachedPage
+        self.version = 0  # goes up whenever rows are written
+        self.lock = threading.Lock()
+
+    def rows_written(self, source, rows, positions):
+        # New rows change every page that shows rows
+        with self.lock:
+            self.version += 1
+
+    def clear(self):
+        with self.lock:
+            self.pages.clear()
+
+    def lookup(self, key, shows_rows):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is None:
+                return None
+            if shows_rows and (page.version != self.version or time.monotonic() - page.stored_at > self.ttl):
+                del self.pages[key]
+                return None
+            self.pages.move_to_end(key)
+            return page
+
+    def store(self, key, body, version):
+        page = CachedPage(body, version)
+        with self.lock:
+            # Keep the old timestamp when the page came out the same, so If-Modified-Since still matches
+            previous = self.pages.get(key)
+            if previous is not None and previous.etag == page.etag:
+                page.last_modified = previous.last_modified
+            self.pages[key] = page
+            self.pages.move_to_end(key)
+            while len(self.pages) > self.size:
+                self.pages.popitem(last=False)
+        return page
+
+    def cached(self, shows_rows=False):
+        # Cache what a view renders for GET requests and answer repeat visits with 304 when nothing changed
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if request.method != 'GET':
+                    return view(*args, **kwargs)
+
+                # Notice edits to the tenants file (which clear the cache) even while every page is a hit
+                tenant_registry.current()
+
+                key = request.full_path
+                page = self.lookup(key, shows_rows)
+                if page is None:
+                    # Read the version first so rows written while rendering make the page stale, not lost
+                    version = self.version
+                    body = view(*args, **kwargs)
+                    if not isinstance(body, str):
+                        # Errors and redirects are passed on as they are
+                        return body
+                    page = self.store(key, body, version)
+
+                response = Response(page.body, mimetype='text/html')
+                response.set_etag(page.etag)
+                response.last_modified = page.last_modified
+                response.cache_control.no_cache = True
+                return response.make_conditional(request)
+            return wrapper
+        return decorator
+
+
+# Shared cache used by the apps; PAGE_CACHE_TTL (seconds) bounds how stale a page showing rows can get
+page_cache = PageCache(
+    size=int(os.getenv('PAGE_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('PAGE_CACHE_TTL', '60')),
+)
+
+# Forget pages showing rows as soon as new rows are written, and every page when the user picker changes
+add_write_listener(page_cache.rows_written)
+tenant_registry.add_listener(page_cache.clear)
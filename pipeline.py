@@ -0,0 +1,415 @@
+import json
+import logging
+import os
+import queue
+from functools import partial
+
+import openai
+from dotenv import load_dotenv
+from flask import Blueprint, render_template, request, redirect, url_for, jsonify, Response
+
+from clients import sheets_clients
+from concurrency import run_concurrently
+from headline_sets import HEADLINE_COUNT, GENERATION_MODE, HeadlineSetStream, parse_headline_set
+from prompts import DESCRIPTION_PROMPT, count_tokens, headline_prompt, headline_set_prompt, prompt_compiler
+from storage import open_store
+from emojis import pick_emoji
+from taxonomy import resolve_conditions, validate_conditions, ENGAGEMENT_FORMATS, EMOTIONAL_TRIGGERS, TONES
+from combo_scheduler import coverage_scheduler
+from dedup import headline_index
+from completion_cache import completion_cache
+from openai_client import openai_client
+from batch import batch_runs, start_batch
+from jobs import job_queue
+from metrics import metrics
+from page_cache import page_cache
+from idempotency import submit_ledger
+from tenants import tenant_registry
+from search_index import search_index
+from streaming import stream_job
+
+logger = logging.getLogger(__name__)
+
+# Load the .env file
+load_dotenv()
+
+# Get the OpenAI key from the environment variables
+openai.api_key = os.getenv('OPENAI_KEY')
+
+
+class Pipeline:
+    def __init__(self, name, spreadsheet_key, model, chat=True):
+        # One flavour of the headline generator: where its headlines are written and which model writes them.
+        # Chat models go through ChatCompletion, the older ones through Completion
+        self.name = name
+        self.spreadsheet_key = spreadsheet_key
+        self.model = model
+        self.chat = chat
+
+    def complete(self, compiled, topic, on_token=None):
+        # Fill the topic into the compiled prompt and give the reply as much room as replies to it usually need
+        prompt = prompt_compiler.render(compiled, topic)
+        max_tokens = prompt_compiler.max_tokens(compiled)
+
+        # Use OpenAI's API to create the completion, streamed token by token when someone is listening
+        if self.chat:
+            response = openai_client.chat_completion(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                stream=on_token is not None
+            )
+        else:
+            response = openai_client.completion(engine=self.model, prompt=prompt, max_tokens=max_tokens,
+                                                stream=on_token is not None)
+
+        if on_token is None:
+            choice = response.choices[0]
+            text = choice.message['content'] if self.chat else choice.text
+            finish_reason = choice.get('finish_reason')
+            usage = getattr(response, 'usage', None) or {}
+            tokens = usage.get('completion_tokens') or count_tokens(text)
+        else:
+            # Pass every piece of the reply on as it arrives and put the whole reply together
+            pieces = []
+            finish_reason = None
+            for chunk in response:
+                choice = chunk.choices[0]
+                piece = choice.delta.get('content', '') if self.chat else choice.text
+                finish_reason = choice.get('finish_reason') or finish_reason
+                if piece:
+                    pieces.append(piece)
+                    on_token(piece)
+            text = ''.join(pieces)
+            tokens = count_tokens(text)
+            metrics.record_tokens(self.model, 0, tokens)
+
+        # Remember how long the reply was, and whether it was cut off, to size the next max_tokens
+        prompt_compiler.observe(compiled, tokens, truncated=finish_reason == 'length')
+        return text
+
+    def create_headline(self, topic, engagement_format, emotional_trigger, tone, on_token=None):
+        # Extract the generated headline from the response
+        with metrics.stage('headline', self.name):
+            return self.complete(headline_prompt(engagement_format, emotional_trigger, tone), topic,
+                                 on_token=on_token).strip()
+
+    def create_description(self, topic):
+        def create():
+            # Get the suggested description and make sure it's 30 words or less
+            return ' '.join(self.complete(DESCRIPTION_PROMPT, topic).strip().split()[:30])
+
+        # The description only depends on the topic, so repeated topics are answered from the cache
+        with metrics.stage('description', self.name):
+            return completion_cache.get_or_create(self.model, prompt_compiler.render(DESCRIPTION_PROMPT, topic),
+                                                  DESCRIPTION_PROMPT.ceiling, create)
+
+    def create_headline_set(self, topic, engagement_format, emotional_trigger, tone, count, on_event=None):
+        # Ask for all the headlines and the description in a single completion; when streaming, every headline
+        # is passed on piece by piece as the JSON answer arrives
+        compiled = headline_set_prompt(engagement_format, emotional_trigger, tone, count)
+        on_token = HeadlineSetStream(partial(on_event, 'token')).feed if on_event else None
+        with metrics.stage('headline_set', self.name):
+            return parse_headline_set(self.complete(compiled, topic, on_token=on_token), count)
+
+    def create_rows(self, topic, engagement_format, emotional_trigger, tone, on_event=None):
+        # Check the conditions and pick any 'Random' ones; every headline of a submit shares them
+        conditions = [resolve_conditions(engagement_format, emotional_trigger, tone)] * HEADLINE_COUNT
+
+        # Ask for every headline and the description in one completion when they share the same conditions,
+        # streamed or not; a reply that can't be parsed falls back to one call per headline
+        results = None
+        if GENERATION_MODE == 'single' and len(set(conditions)) == 1:
+            try:
+                headlines, description = self.create_headline_set(topic, *conditions[0], len(conditions),
+                                                                  on_event=on_event)
+                results = [item for headline in headlines for item in (headline, description)]
+            except ValueError as error:
+                logger.warning("Falling back to one call per headline: %s", error)
+
+        if results is None:
+            # Queue a headline call and a description call for every headline
+            calls = []
+            for number, (engagement_format, emotional_trigger, tone) in enumerate(conditions):
+                on_token = partial(on_event, 'token', number) if on_event else None
+                calls.append(partial(self.create_headline, topic, engagement_format, emotional_trigger, tone,
+                                     on_token=on_token))
+                calls.append(partial(self.create_description, topic))
+
+            # Send all the OpenAI calls at once and get the results back in order
+            results = run_concurrently(calls)
+
+        rows = []
+        for number, (engagement_format, emotional_trigger, tone) in enumerate(conditions):
+            headline, description = results[2 * number], results[2 * number + 1]
+
+            # Add an emoji picked locally from the headline, format, trigger and tone
+            with metrics.stage('emoji', self.name):
+                emoji = pick_emoji(headline, engagement_format, emotional_trigger, tone)
+            headline_with_emoji = f"{emoji} {headline}"
+
+            rows.append([topic, engagement_format, emotional_trigger, tone, headline_with_emoji, description])
+            if on_event:
+                on_event('row', number, rows[-1])
+
+        return rows
+
+    def create_unique_rows(self, store, topic, engagement_format, emotional_trigger, tone, on_event=None):
+        # Fill any 'Random' choice with a combination this topic hasn't been given before
+        with metrics.stage('conditions', self.name):
+            engagement_format, emotional_trigger, tone = coverage_scheduler.next_conditions(
+                store, topic, engagement_format, emotional_trigger, tone)
+
+        def tokens_only(offset):
+            # Stream the pieces of every headline as they arrive, numbered after the headlines of earlier rounds;
+            # whole rows are only sent once they passed the duplicate check
+            def forward(kind, number, value):
+                if kind == 'token':
+                    on_event(kind, offset + number, value)
+            return forward if on_event else None
+
+        def report(candidates, kept, offset):
+            # Show the rows that are kept and take back the streamed headlines that were dropped
+            if on_event:
+                kept_rows = {id(row) for row in kept}
+                for number, row in enumerate(candidates):
+                    on_event('row' if id(row) in kept_rows else 'dropped', offset + number, row)
+
+        candidates = self.create_rows(topic, engagement_format, emotional_trigger, tone, on_event=tokens_only(0))
+
+        # Drop headlines that are near-duplicates of earlier ones for this topic, and ask once more to replace them
+        with metrics.stage('dedup', self.name):
+            rows = headline_index.unique_rows(store, candidates)
+        report(candidates, rows, 0)
+        if len(rows) < HEADLINE_COUNT:
+            extra_rows = self.create_rows(topic, engagement_format, emotional_trigger, tone,
+                                          on_event=tokens_only(len(candidates)))
+            with metrics.stage('dedup', self.name):
+                replacements = headline_index.unique_rows(store, extra_rows)[:HEADLINE_COUNT - len(rows)]
+            report(extra_rows, replacements, len(candidates))
+            rows += replacements
+        return rows
+
+    def generate_headlines(self, store, topic, engagement_format, emotional_trigger, tone, on_event=None,
+                           idempotency_key=None):
+        # Every stage below, and every OpenAI call, is timed and logged as part of this request
+        with metrics.request('generate_headlines', pipeline=self.name, topic=topic):
+            if idempotency_key is None:
+                rows = self.create_unique_rows(store, topic, engagement_format, emotional_trigger, tone, on_event)
+
+                # Add the data to the store (the Google Spreadsheet by default) in one batch write
+                with metrics.stage('append', self.name):
+                    store.append_rows(rows)
+                return f"{len(rows)} headlines about {topic} have been generated."
+
+            # A repeated submit gets the first one's result, or finishes writing the rows it already generated
+            key = json.dumps([self.name, idempotency_key, topic, engagement_format, emotional_trigger, tone])
+            state, saved = submit_ledger.begin(key)
+            if state == 'done':
+                rows, result = saved
+                for number, row in enumerate(rows if on_event else ()):
+                    on_event('row', number, row)
+                return result
+
+            rows = saved if state == 'staged' else None
+            try:
+                if rows is None:
+                    rows = self.create_unique_rows(store, topic, engagement_format, emotional_trigger, tone, on_event)
+                    submit_ledger.stage(key, rows)
+
+                # Write the staged rows in one batch of their own, so 'done' means written and a failed write
+                # leaves nothing behind for a later flush to write a second time
+                with metrics.stage('append', self.name):
+                    store.write_rows(rows)
+            except BaseException:
+                if rows is None:
+                    submit_ledger.abandon(key)
+                else:
+                    submit_ledger.release(key)
+                raise
+
+            result = f"{len(rows)} headlines about {topic} have been generated."
+            submit_ledger.finish(key, rows, result)
+            return result
+
+    def get_user_sheet(self, user_input):
+        # Map the selected user to their worksheet, as set in the tenant registry
+        worksheet = tenant_registry.worksheet(user_input)
+        if worksheet is None:
+            return None
+        return sheets_clients.worksheet(self.spreadsheet_key, worksheet)
+
+    def get_user_store(self, user_input):
+        # Map the selected user to the store their headlines are written to
+        if tenant_registry.worksheet(user_input) is None:
+            return None
+        return open_store(f"{self.spreadsheet_key}/{user_input.lower()}", partial(self.get_user_sheet, user_input))
+
+    def get_recent_rows(self, store, count=10):
+        # Get the most recent rows of a user's store, oldest first, with every column lined up
+        with metrics.stage('recent_rows', self.name):
+            return store.recent(count)
+
+
+def scoped_key(user_input, key):
+    # The page sends a fresh key with every form it shows, API clients an Idempotency-Key header;
+    # keys only count within one user's sheet
+    return f"{user_input.lower()}:{key}" if key else None
+
+
+def pipeline_blueprint(pipeline, template):
+    # Serve a pipeline's pages under its own name; the templates link with relative endpoints such as '.stream'
+    blueprint = Blueprint(pipeline.name, __name__)
+
+    @blueprint.context_processor
+    def tenants():
+        # Everyone the user picker offers
+        return {'tenants': tenant_registry.users()}
+
+    @blueprint.route('/', methods=['GET', 'POST'])
+    @page_cache.cached()
+    def index():
+        if request.method == 'POST':
+            user_input = request.form['user']  # Get the selected user
+            engagement_format = request.form['engagement_format']  # Get the selected engagement format
+            emotional_trigger = request.form['emotional_trigger']  # Get the selected emotional trigger
+            topic = request.form['topic']  # Get the topic
+            tone = request.form['tone']  # Get the selected tone
+
+            store = pipeline.get_user_store(user_input)
+            if store is None:
+                return "Invalid sheet name."
+
+            try:
+                engagement_format, emotional_trigger, tone = validate_conditions(engagement_format, emotional_trigger, tone)
+            except ValueError as error:
+                return str(error), 400
+
+            # Generate in the background so the request returns right away; the result page polls the job
+            key = scoped_key(user_input, request.form.get('idempotency_key') or request.headers.get('Idempotency-Key'))
+            try:
+                job_id = job_queue.submit(pipeline.generate_headlines, store, topic, engagement_format, emotional_trigger,
+                                          tone, idempotency_key=key)
+            except queue.Full:
+                return "Too many headlines are being generated right now, please try again shortly.", 503
+            return redirect(url_for('.result', job=job_id))
+
+        return render_template(template)
+
+    @blueprint.route('/stream', methods=['POST'])
+    def stream():
+        # Same form as '/', for pages that show the headlines as they arrive: the generation waits in the job
+        # queue like any other submit, and the page listens to the events of the job it gets back
+        store = pipeline.get_user_store(request.form.get('user', ''))
+        if store is None:
+            return "Invalid sheet name.", 400
+
+        try:
+            engagement_format, emotional_trigger, tone = validate_conditions(
+                request.form.get('engagement_format', ''),
+                request.form.get('emotional_trigger', ''),
+                request.form.get('tone', ''),
+            )
+        except ValueError as error:
+            return str(error), 400
+
+        key = scoped_key(request.form['user'],
+                         request.form.get('idempotency_key') or request.headers.get('Idempotency-Key'))
+        try:
+            job_id = job_queue.submit_streamed(pipeline.generate_headlines, store, request.form['topic'],
+                                               engagement_format, emotional_trigger, tone, idempotency_key=key)
+        except queue.Full:
+            return "Too many headlines are being generated right now, please try again shortly.", 503
+        return jsonify({'job_id': job_id, 'events': url_for('.job_events', job_id=job_id)}), 202
+
+    @blueprint.route('/result')
+    @page_cache.cached()
+    def result():
+        description = request.args.get('description')
+        job_id = request.args.get('job')
+        return render_template(template, description=description, job_id=job_id)
+
+    @blueprint.route('/jobs/<job_id>')
+    def job_status(job_id):
+        # Report the progress of a generation job to the polling result page
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        return jsonify(job)
+
+    @blueprint.route('/jobs/<job_id>/events')
+    def job_events(job_id):
+        # Server-sent events of a streamed job, from the first one on, so the page can listen with EventSource
+        events = job_queue.job_events(job_id)
+        if events is None:
+            return jsonify({'error': 'Unknown job'}), 404
+        return Response(stream_job(events), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @blueprint.route('/batch', methods=['POST'])
+    def batch():
+        # Start generating headlines for every topic in the uploaded CSV or JSONL file
+        upload = request.files['file']
+        run = start_batch(upload.read(), upload.filename, pipeline.create_rows, pipeline.get_user_store,
+                          request.form.get('user', tenant_registry.default_user()), request.form.get('seed'),
+                          app_name=pipeline.name)
+        return jsonify(run.status()), 202
+
+    @blueprint.route('/batch/<batch_id>')
+    def batch_status(batch_id):
+        run = batch_runs.get(batch_id)
+        if run is None:
+            return jsonify({'error': 'Unknown batch'}), 404
+        return jsonify(run.status())
+
+    @blueprint.route('/latest_topics')
+    @page_cache.cached(shows_rows=True)
+    def latest_topics():
+        # Number of rows to show, taken from the query string (?n=25) and kept within the cached window
+        count = min(max(request.args.get('n', 10, type=int), 1), 100)
+
+        # Whose rows to show (?user=matt), the first user in the registry by default
+        user_input = request.args.get('user', tenant_registry.default_user())
+        store = pipeline.get_user_store(user_input)
+        if store is None:
+            return "Invalid sheet name.", 400
+
+        # Reverse the rows to display from bottom to top
+        with metrics.request('latest_topics', pipeline=pipeline.name, user=user_input.lower(), count=count):
+            rows = pipeline.get_recent_rows(store, count)[::-1]
+
+        # Combine the topics, tones, and headlines of each row into a list of tuples
+        topic_tone_headlines = [(row[0], row[3], row[4]) for row in rows]
+
+        return render_template('latest_topics.html', topic_tone_headlines=topic_tone_headlines)
+
+    @blueprint.route('/search')
+    @page_cache.cached(shows_rows=True)
+    def search():
+        # Find earlier headlines of a user by keyword (?q=) and exact format, trigger, tone or topic, a page at a time
+        user_input = request.args.get('user', tenant_registry.default_user())
+        store = pipeline.get_user_store(user_input)
+        if store is None:
+            return "Invalid sheet name.", 400
+
+        query = request.args.get('q', '')
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        try:
+            conditions = validate_conditions(request.args.get('engagement_format'),
+                                             request.args.get('emotional_trigger'), request.args.get('tone'))
+        except ValueError as error:
+            return str(error), 400
+        # 'Random' (or nothing) matches any value
+        filters = dict(zip(('engagement_format', 'emotional_trigger', 'tone'),
+                           ('' if value == 'Random' else value for value in conditions)))
+        filters['topic'] = request.args.get('topic', '').strip()
+
+        with metrics.request('search', pipeline=pipeline.name, user=user_input.lower(), page=page):
+            with metrics.stage('search', pipeline.name):
+                results = search_index.search(store, query, filters, page, per_page)
+
+        return render_template('search.html', results=results, query=query, filters=filters, user=user_input.lower(),
+                               formats=ENGAGEMENT_FORMATS, triggers=EMOTIONAL_TRIGGERS, tones=TONES)
+
+    return blueprint
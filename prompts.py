@@ -0,0 +1,122 @@
+import math
+import os
+import threading
+from collections import deque
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Largest reply every kind of prompt is ever given room for
+HEADLINE_MAX_TOKENS = 100
+DESCRIPTION_MAX_TOKENS = 60
+
+
+def headline_set_max_tokens(count):
+    # Room for every headline plus the description and the JSON around them
+    return 40 * count + 80
+
+
+@lru_cache(maxsize=1)
+def encoding():
+    # The chat models' tokenizer when tiktoken is installed and its table can be loaded, otherwise None
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding('cl100k_base')
+    except Exception:
+        return None
+
+
+def count_tokens(text):
+    # Exact with tiktoken; otherwise about 4 characters per token, which is close for English prompts
+    tokenizer = encoding()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+class CompiledPrompt:
+    def __init__(self, kind, before, after, ceiling):
+        # A prompt with everything but the topic already filled in; `kind` groups prompts whose replies are alike
+        self.kind = kind
+        self.before = before
+        self.after = after
+        self.ceiling = ceiling
+
+    def render(self, topic):
+        return self.before + topic + self.after
+
+
+@lru_cache(maxsize=4096)
+def headline_prompt(engagement_format, emotional_trigger, tone):
+    return CompiledPrompt(
+        'headline',
+        "Write one ad headline about ",
+        f".\nEngagement format: {engagement_format}\nEmotional trigger: {emotional_trigger}\nTone: {tone}\n"
+        "Reply with the headline only.",
+        HEADLINE_MAX_TOKENS,
+    )
+
+
+@lru_cache(maxsize=4096)
+def headline_set_prompt(engagement_format, emotional_trigger, tone, count):
+    # One prompt asking for `count` different headlines plus a shared description, answered as JSON
+    return CompiledPrompt(
+        f'headline_set:{count}',
+        f"Create {count} different ad headlines about ",
+        f".\nEngagement format: {engagement_format}\nEmotional trigger: {emotional_trigger}\nTone: {tone}\n"
+        "Also describe the idea behind the topic in 30 words or less.\n"
+        'Answer with JSON only: {"headlines": ["<headline>", ...], "description": "<description>"}',
+        headline_set_max_tokens(count),
+    )
+
+
+DESCRIPTION_PROMPT = CompiledPrompt(
+    'description', "Describe the idea behind the topic ", " in 30 words or less.", DESCRIPTION_MAX_TOKENS)
+
+
+class PromptCompiler:
+    def __init__(self, topic_budget=50, window=200, min_samples=20, headroom=1.25):
+        # Topics are cut to `topic_budget` tokens; max_tokens follows the longest replies among the last `window`
+        self.topic_budget = topic_budget
+        self.window = window
+        self.min_samples = min_samples
+        self.headroom = headroom
+        self.lengths = {}  # prompt kind -> deque of reply lengths in tokens
+        self.lock = threading.Lock()
+
+    def render(self, compiled, topic):
+        # Fill in the topic, keeping only as many words as fit in the topic budget
+        topic = ' '.join(topic.split())
+        while count_tokens(topic) > self.topic_budget and ' ' in topic:
+            topic = topic.rsplit(' ', 1)[0]
+        return compiled.render(topic)
+
+    def max_tokens(self, compiled):
+        # Enough room for nearly every reply seen so far, never more than the prompt's ceiling
+        with self.lock:
+            lengths = sorted(self.lengths.get(compiled.kind, ()))
+        if len(lengths) < self.min_samples:
+            return compiled.ceiling
+        longest = lengths[min(len(lengths) - 1, int(0.99 * len(lengths)))]
+        return min(compiled.ceiling, math.ceil(longest * self.headroom) + 4)
+
+    def observe(self, compiled, tokens, truncated=False):
+        # A reply cut off by max_tokens counts as needing the whole ceiling, so the limit backs off at once
+        with self.lock:
+            lengths = self.lengths.get(compiled.kind)
+            if lengths is None:
+                lengths = self.lengths[compiled.kind] = deque(maxlen=self.window)
+            lengths.append(compiled.ceiling if truncated else tokens)
+
+
+# Shared compiler used by the apps
+prompt_compiler = PromptCompiler(
+    topic_budget=int(os.getenv('PROMPT_TOPIC_TOKENS', '50')),
+    window=int(os.getenv('PROMPT_LENGTH_WINDOW', '200')),
+    min_samples=int(os.getenv('PROMPT_LENGTH_SAMPLES', '20')),
+    headroom=float(os.getenv('PROMPT_TOKEN_HEADROOM', '1.25')),
+)
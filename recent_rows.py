@@ -0,0 +1,123 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+from sheet_writer import write_buffer
+
+
+class RecentRowsCache:
+    def __init__(self, size=100, ttl=60.0, lookahead=50):
+        # Keep the last `size` rows of every worksheet in memory and reload them after `ttl` seconds
+        self.size = size
+        self.ttl = ttl
+        self.lookahead = lookahead
+        self.windows = {}  # worksheet key -> (time loaded, deque of rows)
+        self.last_rows = {}  # worksheet key -> number of the last row with data
+        self.writes = {}  # worksheet key -> batches written so far, to notice writes during a reload
+        self.loading = {}  # worksheet key -> lock held while that worksheet is reloaded
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(worksheet):
+        return (getattr(worksheet, 'spreadsheet_id', None), worksheet.id)
+
+    def recent(self, worksheet, count=10):
+        # Return up to `count` of the most recent rows, oldest first
+        key = self.key(worksheet)
+        window = self.fresh_window(key)
+        if window is None:
+            # Read the sheet outside the cache-wide lock so other worksheets, and writes, don't wait on it;
+            # requests for the same worksheet wait for one reload instead of each making their own
+            with self.lock:
+                loading = self.loading.setdefault(key, threading.Lock())
+            with loading:
+                window = self.fresh_window(key)
+                if window is None:
+                    with self.lock:
+                        writes = self.writes.get(key, 0)
+                    rows = self.load(worksheet)
+                    with self.lock:
+                        # Rows written during the read may be missing from it, so reload next time
+                        loaded_at = time.monotonic() if self.writes.get(key, 0) == writes else -math.inf
+                        window = self.windows[key] = (loaded_at, rows)
+
+        with self.lock:
+            rows = list(window[1])
+        return rows[-count:] if count else []
+
+    def fresh_window(self, key):
+        with self.lock:
+            window = self.windows.get(key)
+        if window is None or time.monotonic() - window[0] > self.ttl:
+            return None
+        return window
+
+    def load(self, worksheet, recounted=False):
+        key = self.key(worksheet)
+        with self.lock:
+            last_row = self.last_rows.get(key)
+        if last_row is None:
+            last_row = self.count_rows(worksheet)
+
+        # Read only the tail of the table, plus some room for rows other processes may have added;
+        # after a recount that still left too little room, read to the end of the sheet
+        first_row = max(2, last_row - self.size + 1)
+        read_until = '' if recounted else last_row + self.lookahead
+        values = worksheet.get(f"A{first_row}:F{read_until}")
+
+        if not recounted and first_row + len(values) - 1 >= read_until:
+            # The whole lookahead was used up, so the row count is stale; count again and retry once.
+            # Rows with a blank topic aren't counted, so the count may stay short of the real last row
+            last_row = self.count_rows(worksheet)
+            with self.lock:
+                self.last_rows[key] = last_row
+            return self.load(worksheet, recounted=True)
+
+        with self.lock:
+            self.last_rows[key] = max(self.last_rows.get(key, 0), last_row, first_row + len(values) - 1)
+        return deque((self.pad(row) for row in values if any(cell.strip() for cell in row)), maxlen=self.size)
+
+    @staticmethod
+    def count_rows(worksheet):
+        # Every generated row has a topic, so the length of column A is the number of rows in use
+        return max(1, len(worksheet.col_values(1)))
+
+    @staticmethod
+    def pad(row):
+        # Fill in trailing blank cells so topic, tone and headline always line up
+        return list(row) + [''] * (6 - len(row))
+
+    def extend(self, worksheet, rows, first_row=None):
+        # Add freshly written rows so the window stays current between reloads
+        key = self.key(worksheet)
+        with self.lock:
+            self.writes[key] = self.writes.get(key, 0) + 1
+            if first_row is not None:
+                # The sheet said where the rows went, which also counts rows added by anyone else
+                self.last_rows[key] = max(self.last_rows.get(key, 0), first_row + len(rows) - 1)
+            elif key in self.last_rows:
+                self.last_rows[key] += len(rows)
+            window = self.windows.get(key)
+            if window is not None:
+                window[1].extend(self.pad(row) for row in rows)
+
+    def invalidate(self, worksheet=None):
+        with self.lock:
+            if worksheet is None:
+                self.windows.clear()
+                self.last_rows.clear()
+            else:
+                self.windows.pop(self.key(worksheet), None)
+                self.last_rows.pop(self.key(worksheet), None)
+
+
+# Shared cache used by the apps; RECENT_ROWS_TTL is in seconds
+recent_rows = RecentRowsCache(
+    size=int(os.getenv('RECENT_ROWS_SIZE', '100')),
+    ttl=float(os.getenv('RECENT_ROWS_TTL', '60')),
+)
+
+# Keep the cached recent rows in step with every batch written to the sheet
+write_buffer.add_listener(recent_rows.extend)
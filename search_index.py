@@ -0,0 +1,165 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from storage import add_write_listener, topic_key
+
+# Columns that can be filtered on exactly, next to the keyword search
+FILTERS = ('topic', 'engagement_format', 'emotional_trigger', 'tone')
+
+TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+# Bumped whenever the tables change; an index built by an older version is dropped and read again
+SCHEMA_VERSION = 2
+
+
+def match_expression(query):
+    # Every word has to appear, as a whole word or the start of one; quoting keeps FTS syntax out of user input
+    return ' '.join(f'"{term}"*' for term in TERM_PATTERN.findall(query))
+
+
+class SearchIndex:
+    def __init__(self, path='search.db', sync_interval=300):
+        # A local copy of every store's rows with a full-text index over topic, headline and description.
+        # Each row is kept under its position in the store, so reading a row twice doesn't index it twice.
+        # Rows are indexed as the apps write them, and every `sync_interval` seconds a search also reads
+        # every row past the last one read from the store, which picks up rows typed straight into the sheet.
+        # The duplicate check and the combination scheduler read a topic's history from here as well
+        self.sync_interval = sync_interval
+        self.synced_at = {}  # source -> when this process last read new rows from it
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # The index only holds copies, so an older layout is simply built again
+            self.connection.executescript(
+                "DROP TABLE IF EXISTS entries_text; DROP TABLE IF EXISTS entries; DROP TABLE IF EXISTS synced;"
+                f"PRAGMA user_version = {SCHEMA_VERSION};"
+            )
+        self.connection.executescript(
+            "CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, source TEXT NOT NULL, "
+            "position INTEGER NOT NULL, topic TEXT, topic_key TEXT, engagement_format TEXT, emotional_trigger TEXT, "
+            "tone TEXT, headline TEXT, description TEXT, UNIQUE (source, position));"
+            "CREATE INDEX IF NOT EXISTS entries_topic ON entries (source, topic_key, position);"
+            "CREATE INDEX IF NOT EXISTS entries_format ON entries (source, engagement_format);"
+            "CREATE INDEX IF NOT EXISTS entries_trigger ON entries (source, emotional_trigger);"
+            "CREATE INDEX IF NOT EXISTS entries_tone ON entries (source, tone);"
+            "CREATE VIRTUAL TABLE IF NOT EXISTS entries_text USING fts5("
+            "topic, headline, description, content='entries', content_rowid='id');"
+            "CREATE TABLE IF NOT EXISTS synced (source TEXT PRIMARY KEY, position INTEGER NOT NULL);"
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()  # one copy at a time; searches arriving meanwhile wait and reuse it
+
+    def synced_position(self, source):
+        # The position of the last row read from the source, or None when it was never read
+        row = self.connection.execute("SELECT position FROM synced WHERE source = ?", (source,)).fetchone()
+        return row[0] if row is not None else None
+
+    def insert(self, source, positioned_rows):
+        # Add the rows not indexed yet, in one transaction; the caller holds the lock
+        with self.connection:
+            for position, row in positioned_rows:
+                row = (list(row) + [''] * (6 - len(row)))[:6]
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO entries (source, position, topic, topic_key, engagement_format, "
+                    "emotional_trigger, tone, headline, description) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (source, position, row[0], topic_key(row[0]), *row[1:]))
+                if cursor.rowcount:
+                    self.connection.execute(
+                        "INSERT INTO entries_text (rowid, topic, headline, description) VALUES (?, ?, ?, ?)",
+                        (cursor.lastrowid, row[0], row[4], row[5]))
+
+    def rows_written(self, source, rows, positions):
+        # Index new rows as soon as they land. Rows of a source that was never read, or whose positions the
+        # store didn't report, come with the next read; the read position isn't moved, so that read still
+        # finds rows typed in before these
+        if positions is None:
+            return
+        with self.lock:
+            if self.synced_position(source) is not None:
+                self.insert(source, zip(positions, rows))
+
+    def stale(self, source):
+        return time.monotonic() - self.synced_at.get(source, -math.inf) > self.sync_interval
+
+    def sync(self, store):
+        # Read the rows past the last one read before, without holding the lock while reading them
+        source = store.source()
+        with self.lock:
+            position = self.synced_position(source) or 0
+        positioned_rows = store.rows_since(position)
+        with self.lock:
+            self.insert(source, positioned_rows)
+            if positioned_rows:
+                position = max(position, positioned_rows[-1][0])
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO synced VALUES (?, ?)", (source, position))
+            self.synced_at[source] = time.monotonic()
+
+    def refresh(self, store):
+        # Read the store's new rows when the last read is too old; returns the store's source
+        source = store.source()
+        if self.stale(source):
+            with self.sync_lock:
+                if self.stale(source):
+                    self.sync(store)
+        return source
+
+    def topic_rows(self, store, topic, limit=None):
+        # The latest `limit` rows (all by default) of one topic, matched without case, oldest first
+        source = self.refresh(store)
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT topic, engagement_format, emotional_trigger, tone, headline, description FROM entries "
+                "WHERE source = ? AND topic_key = ? ORDER BY position DESC LIMIT ?",
+                (source, topic_key(topic), limit or -1)
+            ).fetchall()
+        return [list(row) for row in reversed(rows)]
+
+    def search(self, store, query='', filters=None, page=1, per_page=20):
+        # One page of matching rows, newest first, and how many there are in total
+        source = self.refresh(store)
+
+        conditions = ["source = ?"]
+        parameters = [source]
+        expression = match_expression(query)
+        if expression:
+            conditions.append("id IN (SELECT rowid FROM entries_text WHERE entries_text MATCH ?)")
+            parameters.append(expression)
+        for column, value in (filters or {}).items():
+            if column in FILTERS and value:
+                if column == 'topic':
+                    column, value = 'topic_key', topic_key(value)
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        where = ' AND '.join(conditions)
+
+        with self.lock:
+            total = self.connection.execute(f"SELECT COUNT(*) FROM entries WHERE {where}", parameters).fetchone()[0]
+            rows = self.connection.execute(
+                f"SELECT topic, engagement_format, emotional_trigger, tone, headline, description FROM entries "
+                f"WHERE {where} ORDER BY position DESC LIMIT ? OFFSET ?",
+                parameters + [per_page, (page - 1) * per_page]
+            ).fetchall()
+
+        return {
+            'rows': [list(row) for row in rows],
+            'total': total,
+            'page': page,
+            'pages': max(1, math.ceil(total / per_page)),
+            'per_page': per_page,
+        }
+
+
+# Shared index used by the apps; SEARCH_SYNC_INTERVAL is in seconds
+search_index = SearchIndex(
+    path=os.getenv('SEARCH_DB', 'search.db'),
+    sync_interval=float(os.getenv('SEARCH_SYNC_INTERVAL', '300')),
+)
+
+# Keep the index in step with every batch of rows written by the apps
+add_write_listener(search_index.rows_written)
@@ -0,0 +1,142 @@
+import atexit
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from gspread.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: quota exceeded and temporary server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# The first row number in an A1 range such as "'Sheet 1'!A12:F14"
+RANGE_FIRST_ROW = re.compile(r'![A-Z]+(\d+)')
+
+
+def first_row(response):
+    # The sheet row the appended rows start at, from the append response; None when it doesn't say
+    updated_range = ((response or {}).get('updates') or {}).get('updatedRange', '')
+    match = RANGE_FIRST_ROW.search(updated_range)
+    return int(match.group(1)) if match else None
+
+
+class SheetWriteBuffer:
+    def __init__(self, flush_interval=0.0, max_retries=5, backoff=1.0):
+        # With a flush interval of 0 rows are written as soon as a request hands them over,
+        # otherwise rows from several requests are collected and written together
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pending = {}  # worksheet id -> (worksheet, rows waiting to be written)
+        self.listeners = []  # called with (worksheet, rows, first row number or None) after every successful write
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def add_rows(self, worksheet, rows):
+        with self.lock:
+            self.pending.setdefault(self.key(worksheet), (worksheet, []))[1].extend(rows)
+
+        if self.flush_interval <= 0:
+            self.flush(worksheet)
+        else:
+            self.start()
+
+    @staticmethod
+    def key(worksheet):
+        return (getattr(worksheet, 'spreadsheet_id', None), worksheet.id)
+
+    def start(self):
+        # Start the background flusher the first time it is needed
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='sheet-writer', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush buffered rows to Google Sheets")
+
+    def flush(self, worksheet=None):
+        # Write every worksheet's pending rows; only one flush at a time so the rows keep their order in the sheet.
+        # Rows that could not be written are kept for the next flush. With `worksheet` only a failure to write
+        # that worksheet's rows is raised, so one broken sheet doesn't fail everyone else's writes; without it
+        # the first failure is raised once every worksheet was tried
+        errors = {}
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+
+            for key, (pending_worksheet, rows) in pending.items():
+                try:
+                    response = self.append_with_retry(pending_worksheet, rows)
+                except Exception as error:
+                    # Put the rows back in front of anything added meanwhile so nothing is lost
+                    with self.lock:
+                        newer = self.pending.get(key, (pending_worksheet, []))[1]
+                        self.pending[key] = (pending_worksheet, rows + newer)
+                    errors[key] = error
+                    continue
+
+                for listener in self.listeners:
+                    listener(pending_worksheet, rows, first_row(response))
+
+        if worksheet is not None:
+            for key, error in errors.items():
+                if key != self.key(worksheet):
+                    logger.error("Could not write %s buffered rows to worksheet %s, keeping them: %s",
+                                 len(pending[key][1]), key[1], error)
+            error = errors.get(self.key(worksheet))
+        else:
+            error = next(iter(errors.values()), None)
+        if error is not None:
+            raise error
+
+    def write(self, worksheet, rows):
+        # Write these rows now, apart from the buffered ones; when that fails they are not kept for a later
+        # flush, so whoever handed them over decides alone whether they are written again
+        with self.flush_lock:
+            response = self.append_with_retry(worksheet, rows)
+            for listener in self.listeners:
+                listener(worksheet, rows, first_row(response))
+
+    def append_with_retry(self, worksheet, rows):
+        for attempt in range(self.max_retries + 1):
+            try:
+                # One batch call for all the rows of this worksheet
+                return worksheet.append_rows(rows)
+            except APIError as error:
+                status = getattr(getattr(error, 'response', None), 'status_code', None)
+                if status not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    raise
+
+                # Exponential backoff with jitter before trying again
+                delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+                logger.warning("Google Sheets returned %s, retrying in %.1fs", status, delay)
+                time.sleep(delay)
+
+    def close(self):
+        # Stop the background flusher and write whatever is left
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.flush_interval + 1)
+        self.flush()
+
+
+# Shared buffer used by the apps; SHEETS_FLUSH_INTERVAL (seconds) groups writes from several requests
+write_buffer = SheetWriteBuffer(
+    flush_interval=float(os.getenv('SHEETS_FLUSH_INTERVAL', '0')),
+    max_retries=int(os.getenv('SHEETS_MAX_RETRIES', '5')),
+)
+atexit.register(write_buffer.close)
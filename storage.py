@@ -0,0 +1,250 @@
+import abc
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from recent_rows import recent_rows
+from sheet_writer import write_buffer
+
+logger = logging.getLogger(__name__)
+
+# Columns of a headline row, in the order they appear in the spreadsheet
+COLUMNS = ["Topic", "Engagement Format", "Emotional Trigger", "Tone", "Headline", "Description"]
+
+# Called with the source (see HeadlineStore.source), the new rows and their positions in it (see rows_since),
+# or None for positions when the store didn't say, once the rows can be read back
+write_listeners = []
+
+
+def add_write_listener(listener):
+    write_listeners.append(listener)
+
+
+def rows_written(source, rows, positions=None):
+    for listener in write_listeners:
+        listener(source, rows, positions)
+
+
+def topic_key(topic):
+    return topic.strip().lower()
+
+
+def sheet_source(worksheet):
+    return f"sheets:{getattr(worksheet, 'spreadsheet_id', None)}/{worksheet.id}"
+
+
+class HeadlineStore(abc.ABC):
+    # Where generated headline rows are written to and read back from; a store missing one of the
+    # abstract methods can't be created at all
+
+    @abc.abstractmethod
+    def append_rows(self, rows):
+        pass
+
+    @abc.abstractmethod
+    def recent(self, count=10):
+        # The most recent rows, oldest first
+        pass
+
+    @abc.abstractmethod
+    def all_rows(self):
+        # Every row in the store, oldest first
+        pass
+
+    def rows_since(self, position):
+        # (position, row) pairs of the rows after `position`, oldest first; positions only ever grow,
+        # start above 0 and can have gaps
+        return list(enumerate(self.all_rows(), start=1))[position:]
+
+    @abc.abstractmethod
+    def source(self):
+        # Names where the rows really live, so stores sharing a worksheet or table share it too
+        pass
+
+    def write_rows(self, rows):
+        # Write the rows right away, or raise without keeping any of them for a later write
+        self.append_rows(rows)
+
+    def flush(self):
+        # Make sure every row handed to append_rows has been written
+        pass
+
+
+class SheetsStore(HeadlineStore):
+    def __init__(self, get_worksheet):
+        # The worksheet is looked up on use so nothing connects to Google until it is needed
+        self.get_worksheet = get_worksheet
+
+    def append_rows(self, rows):
+        write_buffer.add_rows(self.worksheet(), rows)
+
+    def write_rows(self, rows):
+        write_buffer.write(self.worksheet(), rows)
+
+    def worksheet(self):
+        worksheet = self.get_worksheet()
+
+        # Check if the header row exists
+        if worksheet.row_count == 0:
+            # Append column headers to the sheet
+            worksheet.append_row(COLUMNS)
+        return worksheet
+
+    def recent(self, count=10):
+        return recent_rows.recent(self.get_worksheet(), count)
+
+    def all_rows(self):
+        # Skip the header row
+        return self.get_worksheet().get_all_values()[1:]
+
+    def rows_since(self, position):
+        # Read only the tail of the sheet below row `position`; positions are sheet row numbers, blank rows skipped
+        first = max(position + 1, 2)
+        values = self.get_worksheet().get(f"A{first}:F")
+        return [(number, recent_rows.pad(row)) for number, row in enumerate(values, start=first)
+                if any(cell.strip() for cell in row)]
+
+    def source(self):
+        return sheet_source(self.get_worksheet())
+
+    def flush(self):
+        write_buffer.flush(self.get_worksheet())
+
+
+class SQLiteStore(HeadlineStore):
+    connections = {}  # database path -> shared connection
+    connections_lock = threading.Lock()
+
+    def __init__(self, name, path='headlines.db'):
+        # Every store keeps its rows in the same table, told apart by name
+        self.name = name
+        self.path = path
+        self.connection, self.lock = self.connect(path)
+
+    @classmethod
+    def connect(cls, path):
+        with cls.connections_lock:
+            if path not in cls.connections:
+                connection = sqlite3.connect(path, check_same_thread=False)
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS headlines ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, store TEXT NOT NULL, topic TEXT, "
+                    "engagement_format TEXT, emotional_trigger TEXT, tone TEXT, headline TEXT, "
+                    "description TEXT, created_at REAL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS headlines_store_id ON headlines (store, id)")
+                connection.execute("CREATE INDEX IF NOT EXISTS headlines_store_topic ON headlines (store, topic)")
+                connection.commit()
+                cls.connections[path] = (connection, threading.Lock())
+            return cls.connections[path]
+
+    def append_rows(self, rows):
+        now = time.time()
+        values = [(self.name, *(list(row) + [''] * (6 - len(row)))[:6], now) for row in rows]
+        with self.lock:
+            # Row ids are the rows' positions
+            positions = [self.connection.execute(
+                "INSERT INTO headlines (store, topic, engagement_format, emotional_trigger, tone, headline, "
+                "description, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                value
+            ).lastrowid for value in values]
+            self.connection.commit()
+        rows_written(self.source(), rows, positions)
+
+    def recent(self, count=10):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT topic, engagement_format, emotional_trigger, tone, headline, description "
+                "FROM headlines WHERE store = ? ORDER BY id DESC LIMIT ?",
+                (self.name, count)
+            ).fetchall()
+        return [list(row) for row in reversed(rows)]
+
+    def all_rows(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT topic, engagement_format, emotional_trigger, tone, headline, description "
+                "FROM headlines WHERE store = ? ORDER BY id",
+                (self.name,)
+            ).fetchall()
+        return [list(row) for row in rows]
+
+    def rows_since(self, position):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, topic, engagement_format, emotional_trigger, tone, headline, description "
+                "FROM headlines WHERE store = ? AND id > ? ORDER BY id",
+                (self.name, position)
+            ).fetchall()
+        return [(row[0], list(row[1:])) for row in rows]
+
+    def source(self):
+        return f"sqlite:{self.path}/{self.name}"
+
+
+class MirroredStore(HeadlineStore):
+    # Serves everything from the local store and copies new rows to Google Sheets in the background
+    mirror_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sheets-mirror')
+
+    def __init__(self, primary, mirror):
+        self.primary = primary
+        self.mirror = mirror
+
+    def append_rows(self, rows):
+        self.primary.append_rows(rows)
+        self.mirror_executor.submit(self.copy_to_mirror, rows)
+
+    def write_rows(self, rows):
+        self.primary.write_rows(rows)
+        self.mirror_executor.submit(self.copy_to_mirror, rows)
+
+    def copy_to_mirror(self, rows):
+        try:
+            self.mirror.append_rows(rows)
+        except Exception:
+            logger.exception("Failed to mirror %s rows to Google Sheets", len(rows))
+
+    def recent(self, count=10):
+        return self.primary.recent(count)
+
+    def all_rows(self):
+        return self.primary.all_rows()
+
+    def rows_since(self, position):
+        return self.primary.rows_since(position)
+
+    def source(self):
+        return self.primary.source()
+
+    def flush(self):
+        self.primary.flush()
+
+
+# Rows written to Google Sheets can be read back once the buffer has sent them; their positions are row numbers
+write_buffer.add_listener(lambda worksheet, rows, first_row: rows_written(
+    sheet_source(worksheet), rows, None if first_row is None else list(range(first_row, first_row + len(rows)))))
+
+
+# HEADLINE_STORE picks where rows go: 'sheets' (default), 'sqlite', or 'sqlite+sheets' to mirror to Sheets
+STORE_BACKEND = os.getenv('HEADLINE_STORE', 'sheets').lower()
+HEADLINE_DB = os.getenv('HEADLINE_DB', 'headlines.db')
+
+stores = {}
+stores_lock = threading.Lock()
+
+
+def open_store(name, get_worksheet):
+    # One store per name, created the first time it is asked for
+    with stores_lock:
+        if name not in stores:
+            if STORE_BACKEND == 'sqlite':
+                stores[name] = SQLiteStore(name, HEADLINE_DB)
+            elif STORE_BACKEND == 'sqlite+sheets':
+                stores[name] = MirroredStore(SQLiteStore(name, HEADLINE_DB), SheetsStore(get_worksheet))
+            else:
+                stores[name] = SheetsStore(get_worksheet)
+        return stores[name]
@@ -0,0 +1,34 @@
+import json
+
+# Seconds between keep-alive comments while waiting for OpenAI, so proxies don't close the stream
+KEEP_ALIVE = 15
+
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_data(kind, number, value):
+    if kind == 'done':
+        return {'message': value}
+    if kind == 'failed':
+        return {'error': value}
+    return {'number': number, 'text' if kind == 'token' else 'row': value}
+
+
+def stream_job(events):
+    # Pass on the events of a streamed generation job from the first one on:
+    # 'token' for every piece of a headline, 'row' for every row kept, 'dropped' for every headline left out
+    # as a duplicate, then 'done' or 'failed'
+    position = 0
+    while True:
+        new_events = events.read(position, KEEP_ALIVE)
+        if not new_events:
+            yield ": keep-alive\n\n"
+            continue
+
+        for kind, number, value in new_events:
+            yield server_sent_event(kind, event_data(kind, number, value))
+            if kind in ('done', 'failed'):
+                return
+        position += len(new_events)
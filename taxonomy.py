@@ -0,0 +1,205 @@
+import random
+import sys
+from types import MappingProxyType
+
+
+def as_values(names):
+    # Interned, immutable list of names so comparisons and dict lookups stay cheap
+    return tuple(sys.intern(name) for name in names)
+
+
+# Define the lists of engagement formats, emotional triggers and tones
+ENGAGEMENT_FORMATS = as_values([
+    'Call to Action',
+    'Clickbait',
+    'Innovation Driving Cost Benefit',
+    'Missed Opportunity Awareness',
+    'Offer Announcement + Call to Action',
+    'Offer Announcement + Inclusivity',
+    'Price Discovery',
+    'Prices May Surprise You',
+    'Problem Statement + Solution',
+    'Provocative Questioning',
+    'Question',
+    'Question + Call to Action',
+    'Question + Problem Statement + Solution',
+    'Question + Solution',
+    'Search Call to Action',
+    'Statement',
+    'Statement + Call to Action',
+    'Statement + Expectation Challenge',
+    'Statement Regarding Health Symptoms',
+    'Statistics Based',
+    'Topic Introduction',
+    'Offer Announcement + Exclusivity',
+    'Fear of Missing Out',
+    'Tactics to Try Tonight',
+    'Question + Urgency',
+    'Question + Offer',
+    'How To',
+    'How To + Treatments',
+    'Seniors Have Been Experiencing',
+    'List of Symptoms',
+    'Deals'
+])
+
+EMOTIONAL_TRIGGERS = as_values([
+    'Adventure',
+    'Affinity',
+    'Affordability',
+    'Ambition',
+    'Anger',
+    'Anticipation',
+    'Convenience',
+    'Cost Sensitivity',
+    'Curiosity',
+    'Danger',
+    'Discovery',
+    'Easy Accessibility',
+    'Empowerment',
+    'Envy',
+    'Fear of Ignoring Health Symptoms',
+    'Fear of Missing Information',
+    'Fear of Missing Out',
+    'Fear of Old Age',
+    'Fear of Potential Health Issue',
+    'Financial Gain',
+    'Greed',
+    'Hope',
+    'Hop and Affordability',
+    'Improve Compensation Level',
+    'Improve Financial Situation',
+    'Improve Quality of Life',
+    'Localization',
+    'Love',
+    'Nostalgia',
+    'Not Too Late',
+    'Opportunity',
+    'Optimism',
+    'Relief',
+    'Savings',
+    'Scarcity',
+    'Security',
+    'Surprise',
+    'Timeliness',
+    'Transparency',
+    'Trust',
+    'Urgency',
+    'Validation',
+    'Vanity'
+])
+
+TONES = as_values([
+    'Happy',
+    'Excited',
+    'Sad',
+    'Anxious',
+    'Calm',
+    'Passionate',
+    'Serious',
+    'Humorous',
+    'Ironic',
+    'Inspiring',
+    'Empathetic',
+    'Formal',
+    'Casual',
+    'Optimistic',
+    'Pessimistic',
+    'Fearful',
+    'Nostalgic',
+    'Affectionate',
+    'Sympathetic',
+    'Curious',
+    'Energetic',
+    'Indifferent',
+    'Confident',
+    'Surprised',
+    'Angry',
+    'Suspenseful',
+    'Mysterious',
+    'Hopeful',
+    'Gloomy',
+    'Skeptical'
+])
+
+# Tones offered by the forms that are not in the list above; accepted, but never picked at random
+FORM_ONLY_TONES = as_values([
+    'Friendly',
+    'Professional',
+    'Inquisitive',
+    'Informative',
+    'Persuasive',
+    'Sarcastic',
+    'Enthusiastic',
+    'Conversational',
+    'Instructional',
+    'Promotional'
+])
+
+
+def lookup_table(*groups):
+    # Case-insensitive lookup from what a form or file may send to the canonical name
+    return MappingProxyType({name.lower(): name for group in groups for name in group})
+
+
+FORMAT_LOOKUP = lookup_table(ENGAGEMENT_FORMATS)
+TRIGGER_LOOKUP = lookup_table(EMOTIONAL_TRIGGERS)
+TONE_LOOKUP = lookup_table(TONES, FORM_ONLY_TONES)
+
+
+def is_random(value):
+    # An empty choice counts as 'Random' too
+    return not value or value.strip().lower() == 'random'
+
+
+def canonical(lookup, value, kind):
+    name = lookup.get(value.strip().lower())
+    if name is None:
+        raise ValueError(f"Unknown {kind}: {value}")
+    return name
+
+
+def validate_conditions(engagement_format, emotional_trigger, tone):
+    # Check the chosen conditions but leave 'Random' for later; raises ValueError
+    return (
+        'Random' if is_random(engagement_format) else canonical(FORMAT_LOOKUP, engagement_format, 'engagement format'),
+        'Random' if is_random(emotional_trigger) else canonical(TRIGGER_LOOKUP, emotional_trigger, 'emotional trigger'),
+        'Random' if is_random(tone) else canonical(TONE_LOOKUP, tone, 'tone'),
+    )
+
+
+def resolve_conditions(engagement_format, emotional_trigger, tone, rng=random):
+    # Check the chosen conditions and replace any 'Random' with a pick from the lists; raises ValueError
+    if is_random(engagement_format):
+        engagement_format = rng.choice(ENGAGEMENT_FORMATS)
+    else:
+        engagement_format = canonical(FORMAT_LOOKUP, engagement_format, 'engagement format')
+
+    if is_random(emotional_trigger):
+        emotional_trigger = rng.choice(EMOTIONAL_TRIGGERS)
+    else:
+        emotional_trigger = canonical(TRIGGER_LOOKUP, emotional_trigger, 'emotional trigger')
+
+    if is_random(tone):
+        tone = rng.choice(TONES)
+    else:
+        tone = canonical(TONE_LOOKUP, tone, 'tone')
+
+    return engagement_format, emotional_trigger, tone
+
+
+class Sampler:
+    def __init__(self, seed=None):
+        # A seeded sampler gives the same combinations every run, which makes batches repeatable
+        self.rng = random.Random(seed)
+
+    def sample(self, count):
+        # Draw `count` (format, trigger, tone) combinations at once
+        return list(zip(
+            self.rng.choices(ENGAGEMENT_FORMATS, k=count),
+            self.rng.choices(EMOTIONAL_TRIGGERS, k=count),
+            self.rng.choices(TONES, k=count),
+        ))
+
+    def resolve(self, engagement_format, emotional_trigger, tone):
+        return resolve_conditions(engagement_format, emotional_trigger, tone, self.rng)
@@ -0,0 +1,89 @@
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Used when there is no tenants file: each copywriter's worksheet, by position or by title
+DEFAULT_TENANTS = {
+    'january': {'name': 'January', 'worksheet': 0},
+    'matt': {'name': 'Matt', 'worksheet': 1},
+}
+
+
+class TenantRegistry:
+    def __init__(self, path='tenants.json', refresh=30):
+        # Copywriters and their worksheets, read from a JSON file that is checked for changes every `refresh` seconds,
+        # so adding someone only means editing the file
+        self.path = path
+        self.refresh = refresh
+        self.tenants = DEFAULT_TENANTS
+        self.modified = None
+        self.checked_at = None
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add_listener(self, listener):
+        # Called without arguments whenever the tenants change
+        self.listeners.append(listener)
+
+    def current(self):
+        if self.checked_at is None or time.monotonic() - self.checked_at >= self.refresh:
+            self.reload()
+        return self.tenants
+
+    def reload(self):
+        with self.lock:
+            self.checked_at = time.monotonic()
+            try:
+                modified = os.path.getmtime(self.path)
+            except OSError:
+                modified = None
+            if modified == self.modified:
+                return
+
+            try:
+                tenants = self.load() if modified is not None else DEFAULT_TENANTS
+            except (OSError, ValueError) as error:
+                # Keep serving the tenants we have rather than locking everyone out over a typo
+                logger.error("Could not read %s, keeping the current tenants: %s", self.path, error)
+                return
+            self.tenants, self.modified = tenants, modified
+
+        for listener in self.listeners:
+            listener()
+
+    def load(self):
+        with open(self.path) as tenants_file:
+            data = json.load(tenants_file)
+        if not isinstance(data, dict) or not data:
+            raise ValueError("expected an object of users")
+
+        tenants = {}
+        for user, tenant in data.items():
+            worksheet = tenant.get('worksheet') if isinstance(tenant, dict) else None
+            if isinstance(worksheet, bool) or not isinstance(worksheet, (int, str)):
+                raise ValueError(f"{user} needs a worksheet index or title")
+            tenants[user.lower()] = {'name': tenant.get('name', user), 'worksheet': worksheet}
+        return tenants
+
+    def worksheet(self, user):
+        # The worksheet index or title of a user, or None for someone unknown
+        tenant = self.current().get(user.lower())
+        return tenant['worksheet'] if tenant is not None else None
+
+    def users(self):
+        # (user, display name) pairs in the order of the file, for the user picker
+        return [(user, tenant['name']) for user, tenant in self.current().items()]
+
+    def default_user(self):
+        return next(iter(self.current()))
+
+
+# Shared registry used by the apps; TENANTS_REFRESH is in seconds
+tenant_registry = TenantRegistry(
+    path=os.getenv('TENANTS_FILE', 'tenants.json'),
+    refresh=float(os.getenv('TENANTS_REFRESH', '30')),
+)
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+# Keep the ledger, rate limits and search index of the test apart from the real ones
+workdir = tempfile.mkdtemp(prefix='headlines-test-')
+os.environ['IDEMPOTENCY_DB'] = os.path.join(workdir, 'idempotency.db')
+os.environ['OPENAI_LIMITS_DB'] = os.path.join(workdir, 'openai_limits.db')
+os.environ['SEARCH_DB'] = os.path.join(workdir, 'search.db')
+
+from pipeline import Pipeline  # noqa: E402
+from sheet_writer import write_buffer  # noqa: E402
+from storage import SheetsStore  # noqa: E402
+
+ROWS = [['solar panels', 'Listicle', 'Curiosity', 'Friendly', f"Headline {number}", 'Description']
+        for number in range(3)]
+
+
+class FlakyWorksheet:
+    # A worksheet whose first `failures` writes are lost on the way to Google
+    spreadsheet_id = 'test'
+    row_count = 1
+
+    def __init__(self, failures=0):
+        self.id = id(self)
+        self.failures = failures
+        self.rows = []
+
+    def append_rows(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise requests.ConnectionError("connection reset")
+        self.rows.extend(rows)
+
+
+class RetriedSubmitTest(unittest.TestCase):
+    def setUp(self):
+        self.pipeline = Pipeline('test', 'test', 'gpt-3.5-turbo', chat=True)
+        self.create = mock.patch.object(self.pipeline, 'create_unique_rows', return_value=[list(row) for row in ROWS])
+        self.create.start()
+        self.addCleanup(self.create.stop)
+
+    def generate(self, store, key):
+        return self.pipeline.generate_headlines(store, 'solar panels', 'Random', 'Random', 'Random',
+                                                idempotency_key=key)
+
+    def test_failed_write_is_written_once_on_retry(self):
+        worksheet = FlakyWorksheet(failures=1)
+        store = SheetsStore(lambda: worksheet)
+
+        with self.assertRaises(requests.ConnectionError):
+            self.generate(store, 'retry-once')
+        self.assertEqual(worksheet.rows, [])
+
+        self.generate(store, 'retry-once')
+        write_buffer.flush()
+        self.assertEqual(worksheet.rows, ROWS)
+        self.assertEqual(self.pipeline.create_unique_rows.call_count, 1)
+
+        # A third submit with the same key writes nothing more
+        self.generate(store, 'retry-once')
+        write_buffer.flush()
+        self.assertEqual(worksheet.rows, ROWS)
+
+    def test_other_sheets_failing_does_not_fail_the_submit(self):
+        broken = FlakyWorksheet(failures=1)
+        write_buffer.pending[(broken.spreadsheet_id, broken.id)] = (broken, [['other', '', '', '', 'Other', '']])
+        self.addCleanup(write_buffer.pending.clear)
+
+        worksheet = FlakyWorksheet()
+        self.generate(SheetsStore(lambda: worksheet), 'other-sheet')
+        self.assertEqual(worksheet.rows, ROWS)
+
+
+if __name__ == '__main__':
+    unittest.main()
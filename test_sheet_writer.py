@@ -0,0 +1,69 @@
+import unittest
+
+import requests
+from gspread.exceptions import APIError
+
+from sheet_writer import SheetWriteBuffer
+
+
+def api_error(status):
+    response = requests.Response()
+    response.status_code = status
+    response._content = b'{"error": {"code": %d, "message": "Bad request", "status": "INVALID_ARGUMENT"}}' % status
+    return APIError(response)
+
+
+class FakeWorksheet:
+    # A worksheet whose writes fail with `error` while it is set
+    spreadsheet_id = 'test'
+
+    def __init__(self, sheet_id, error=None):
+        self.id = sheet_id
+        self.error = error
+        self.rows = []
+
+    def append_rows(self, rows):
+        if self.error is not None:
+            raise self.error
+        self.rows.extend(rows)
+
+
+class FlushFailureTest(unittest.TestCase):
+    def setUp(self):
+        self.buffer = SheetWriteBuffer(flush_interval=0.0, max_retries=0)
+        self.broken = FakeWorksheet(1, api_error(400))
+        self.working = FakeWorksheet(2)
+
+    def test_failing_worksheet_keeps_its_rows_and_others_are_written(self):
+        self.buffer.pending[self.buffer.key(self.broken)] = (self.broken, [['broken']])
+        self.buffer.pending[self.buffer.key(self.working)] = (self.working, [['working']])
+
+        with self.assertRaises(APIError):
+            self.buffer.flush()
+
+        self.assertEqual(self.working.rows, [['working']])
+        self.assertEqual(list(self.buffer.pending.values()), [(self.broken, [['broken']])])
+
+    def test_other_worksheets_failure_is_not_raised_to_the_writer(self):
+        self.buffer.pending[self.buffer.key(self.broken)] = (self.broken, [['broken']])
+
+        self.buffer.add_rows(self.working, [['first']])
+        self.buffer.add_rows(self.working, [['second']])
+
+        self.assertEqual(self.working.rows, [['first'], ['second']])
+        self.assertEqual(list(self.buffer.pending.values()), [(self.broken, [['broken']])])
+
+        # Once the sheet works again its rows go out with the next flush
+        self.broken.error = None
+        self.buffer.flush()
+        self.assertEqual(self.broken.rows, [['broken']])
+        self.assertEqual(self.buffer.pending, {})
+
+    def test_own_worksheets_failure_is_raised(self):
+        with self.assertRaises(APIError):
+            self.buffer.add_rows(self.broken, [['broken']])
+        self.assertEqual(list(self.buffer.pending.values()), [(self.broken, [['broken']])])
+
+
+if __name__ == '__main__':
+    unittest.main()